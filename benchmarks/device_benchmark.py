@@ -0,0 +1,393 @@
+"""
+Replay and load benchmark of the Raspberry Pi side. Replays a stream of
+shadow delta documents at a set rate through the update callback of
+shadow_client.MyPaintingMQTTClient, running against the recording pigpio
+and local MQTT stand-ins of raspberry_pi/fake_backends, so it runs on any
+Linux box.
+
+Reports callback latency, messages handled per second, desired state
+messages coalesced and applied, PWM writes issued, reported state
+publishes and fade frame jitter, as JSON.
+
+    $ python benchmarks/device_benchmark.py --messages 2000 --rate 50 --output device.json
+
+Fades run in the control process, or with --driver process in a PWM driver
+process. Busy threads parsing and encoding shadow documents stand in for
+the MQTT client's load, and --cpus pins the benchmark to as many cores as a
+Pi Zero has, so the two can be compared:
+
+    $ python benchmarks/device_benchmark.py --cpus 1 --busy-threads 2 --driver thread
+    $ python benchmarks/device_benchmark.py --cpus 1 --busy-threads 2 --driver process
+"""
+import os
+import sys
+import json
+import time
+import bisect
+import random
+import argparse
+import tempfile
+import functools
+import threading
+
+here = os.path.dirname(os.path.abspath(__file__))
+repo = os.path.dirname(here)
+device_dir = os.path.join(repo, "raspberry_pi")
+
+# Environment the device code runs with during the benchmark
+BENCHMARK_ENV = {
+    "AWS_IOT_MY_THING_NAME": "my_painting",
+    "AWS_IOT_MQTT_CLIENT_ID": "my_painting_benchmark",
+}
+
+# Values of the synthetic stream
+POWER_STATES = ("ON", "OFF")
+COLOR_TEMPERATURES = (1900, 2700, 4000, 5500, "CANDLE", "HALOGEN",
+                      "OVERCAST_SKY")
+
+
+def percentile(sorted_values, percent):
+    """
+    Gives the nearest rank percentile of sorted values.
+
+    Args:
+        sorted_values: list of numbers in increasing order
+        percent: number between 0 and 100
+    Returns:
+        number
+    """
+    if not sorted_values:
+        return None
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+def synthetic_stream(messages, seed):
+    """
+    Generates desired state changes like those of voice commands, mostly
+    power and brightness with some color temperature changes.
+
+    Args:
+        messages: int of changes to generate
+        seed: int of random seed
+    Returns:
+        list of Python dicts of desired state
+    """
+    generator = random.Random(seed)
+    stream = []
+    for _ in range(messages):
+        choice = generator.random()
+        if choice < .3:
+            stream.append({'power_state': generator.choice(POWER_STATES)})
+        elif choice < .8:
+            stream.append({'power_state': "ON",
+                           'brightness': generator.randint(1, 100)})
+        else:
+            stream.append({'color_temperature':
+                           generator.choice(COLOR_TEMPERATURES)})
+    return stream
+
+def load_stream(path):
+    """
+    Reads desired state changes from a file of JSON lines, each either a
+    delta document with a "state" or the desired state itself.
+
+    Args:
+        path: string of file path
+    Returns:
+        list of Python dicts of desired state
+    """
+    stream = []
+    with open(path) as stream_file:
+        for line in stream_file:
+            if line.strip():
+                document = json.loads(line)
+                stream.append(document.get('state', document))
+    return stream
+
+def frame_jitter(writes, interval, deliveries=(), pin_groups=None):
+    """
+    Measures how far fade frames land from the frame interval. Writes of
+    one frame of a light are grouped, and gaps between frames spanning several
+    intervals, as frames with no changed channel are not written, are
+    compared to the nearest multiple of the interval. Gaps over four
+    intervals are taken as the end of a fade, and gaps a message was
+    delivered in, or up to an interval before, as a fade preempted by the
+    next, as the lights take the message up a little after delivery.
+
+    Args:
+        writes: list of (time, pin, value) tuples in time order
+        interval: float of seconds between frames
+        deliveries: sorted list of times messages were delivered
+        pin_groups: list of collections of the pins of each light, or None
+            if all writes are of one light
+    Returns:
+        Python dict of jitter statistics in milliseconds
+    """
+    if pin_groups is None:
+        pin_groups = [set(pin for _, pin, _ in writes)]
+    frame_count = 0
+    jitter = []
+    for pins in pin_groups:
+        frame_times = []
+        for at, pin, _ in writes:
+            if pin in pins and (not frame_times or
+                                at - frame_times[-1] > interval / 4):
+                frame_times.append(at)
+        frame_count += len(frame_times)
+        for previous, current in zip(frame_times, frame_times[1:]):
+            gap = current - previous
+            if gap > interval * 4:
+                continue
+            if bisect.bisect(deliveries, previous - interval) != \
+                    bisect.bisect(deliveries, current):
+                continue
+            frames = max(1, int(round(gap / interval)))
+            jitter.append(abs(gap - frames * interval) * 1000)
+    jitter.sort()
+    return {
+        'frames': frame_count,
+        'measured_gaps': len(jitter),
+        'p50_ms': percentile(jitter, 50),
+        'p99_ms': percentile(jitter, 99),
+        'max_ms': jitter[-1] if jitter else None,
+    }
+
+def busy_loop(stop_event):
+    """
+    Parses and encodes shadow documents until stopped, holding the GIL the
+    way the MQTT client threads, JSON parsing and logging do.
+
+    Args:
+        stop_event: threading.Event set to stop
+    """
+    document = json.dumps({
+        'state': {'desired': {'power_state': "ON", 'brightness': 40,
+                              'color_temperature': 2700},
+                  'reported': {'power_state': "ON", 'brightness': 40,
+                               'color_temperature': 2700}},
+        'metadata': dict(('field{}'.format(index), {'timestamp': index})
+                         for index in range(50)),
+        'version': 1, 'timestamp': 0})
+    while not stop_event.is_set():
+        json.dumps(json.loads(document))
+
+def write_zones_file(zones, directory):
+    """
+    Writes a zones file of zones named zone-<n> on distinct pins.
+
+    Args:
+        zones: int of zones
+        directory: string of directory to write it in
+    Returns:
+        string of file path
+    """
+    path = os.path.join(directory, "zones.json")
+    with open(path, 'w') as zones_file:
+        json.dump({'zones': [{'name': 'zone-{}'.format(index),
+                              'pins': [index * 3, index * 3 + 1,
+                                       index * 3 + 2]}
+                             for index in range(zones)]}, zones_file)
+    return path
+
+def replay(client, mqtt_client, stream, rate, settle):
+    """
+    Delivers the stream to the client's zones in turn, paced at rate
+    messages per second, then waits for the lights to settle.
+
+    Args:
+        client: MyPaintingMQTTClient
+        mqtt_client: LocalMQTTClient of the client
+        stream: list of Python dicts of desired state
+        rate: float of messages per second, or 0 for as fast as possible
+        settle: float of seconds to wait for fades after the last message
+    Returns:
+        Python dict of callback latencies, replay seconds and delivery
+        times
+    """
+    zones = client.zones
+    while not all(zone.update_delta_topic in mqtt_client.subscriptions
+                  for zone in zones):
+        time.sleep(.01)
+    versions = dict((zone.update_delta_topic, 0) for zone in zones)
+    latencies = []
+    deliveries = []
+    start = time.perf_counter()
+    for index, desired in enumerate(stream):
+        if rate:
+            delay = start + index / float(rate) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        topic = zones[index % len(zones)].update_delta_topic
+        versions[topic] += 1
+        payload = json.dumps({'version': versions[topic], 'state': desired,
+                              'timestamp': int(time.time())}).encode('utf-8')
+        delivered = time.perf_counter()
+        mqtt_client.deliver(topic, payload)
+        latencies.append(time.perf_counter() - delivered)
+        deliveries.append(delivered)
+    elapsed = time.perf_counter() - start
+    for zone in zones:
+        zone.light.wait_for_fade(settle)
+    latencies.sort()
+    return {
+        'seconds': elapsed,
+        'deliveries': deliveries,
+        'p50_us': percentile(latencies, 50) * 1e6,
+        'p99_us': percentile(latencies, 99) * 1e6,
+        'max_us': latencies[-1] * 1e6,
+    }
+
+def main():
+    """
+    Runs the benchmark and writes the results as JSON.
+
+    Args:
+        None
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--messages', type=int, default=1000,
+                        help='messages of the synthetic stream')
+    parser.add_argument('--rate', type=float, default=20,
+                        help='messages per second, 0 for as fast as possible')
+    parser.add_argument('--stream',
+                        help='file of JSON lines to replay instead')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed of the synthetic stream')
+    parser.add_argument('--zones', type=int, default=1,
+                        help='lighting zones to spread messages over')
+    parser.add_argument('--debounce', type=float, default=0,
+                        help='debounce seconds of the desired state mailbox')
+    parser.add_argument('--report-interval', type=float, default=1,
+                        help='minimum seconds between reported state publishes')
+    parser.add_argument('--batched', action='store_true',
+                        help='send brightness fades as pigpio scripts')
+    parser.add_argument('--ack-latency', type=float, default=0,
+                        help='seconds before publishes are acknowledged')
+    parser.add_argument('--driver', choices=('thread', 'process'),
+                        default='thread',
+                        help='render fades in the control process or in a '
+                             'PWM driver process')
+    parser.add_argument('--busy-threads', type=int, default=0,
+                        help='threads loading the control process with JSON '
+                             'work')
+    parser.add_argument('--cpus', type=int,
+                        help='cores to run on, 1 as on a Pi Zero')
+    parser.add_argument('--settle', type=float, default=10,
+                        help='most seconds to wait for fades to finish')
+    parser.add_argument('--log-level', default='WARNING',
+                        help='MY_PAINTING_LOG_LEVEL during the benchmark')
+    parser.add_argument('--output', help='file to write JSON results to')
+    args = parser.parse_args()
+
+    state_dir = tempfile.mkdtemp(prefix='my_painting_benchmark')
+    BENCHMARK_ENV['MY_PAINTING_LOG_LEVEL'] = args.log_level
+    BENCHMARK_ENV['MY_PAINTING_STATE_DIR'] = state_dir
+    BENCHMARK_ENV['MY_PAINTING_REPORT_INTERVAL'] = str(args.report_interval)
+    if args.zones > 1:
+        BENCHMARK_ENV['MY_PAINTING_ZONES_FILE'] = write_zones_file(
+            args.zones, state_dir)
+    os.environ.update(BENCHMARK_ENV)
+    os.environ.pop('MY_PAINTING_LAN_PORT', None)
+    os.environ.pop('MY_PAINTING_DRIVER', None)
+    sys.path.insert(0, device_dir)
+    if args.cpus:
+        os.sched_setaffinity(0, range(args.cpus))
+
+    import lights
+    import shadow_client
+    from zone import load_zone_config
+    from pwm_driver import PWMDriver
+    from fake_backends import FakePi, LocalMQTTClient
+
+    if args.stream:
+        stream = load_stream(args.stream)
+    else:
+        stream = synthetic_stream(args.messages, args.seed)
+    pin_groups = [zone['pins'] for zone in load_zone_config()]
+    mqtt_client = LocalMQTTClient(ack_latency=args.ack_latency)
+    if args.driver == 'process':
+        # The driver's FakePi writes its record when the driver stops
+        record_path = os.path.join(state_dir, 'driver-writes.json')
+        pi = None
+        driver = PWMDriver(pin_groups,
+                           functools.partial(FakePi, record_path=record_path),
+                           batched_fades=args.batched)
+    else:
+        pi = FakePi()
+        driver = None
+    client = shadow_client.MyPaintingMQTTClient(debounce=args.debounce,
+                                                mqtt_client=mqtt_client,
+                                                pi=pi, driver=driver)
+    if driver is None:
+        for zone in client.zones:
+            zone.light.batched_fades = args.batched
+
+    results = {}
+    stop_busy = threading.Event()
+    busy_threads = [threading.Thread(target=busy_loop, args=(stop_busy,),
+                                     name='busy-{}'.format(index))
+                    for index in range(args.busy_threads)]
+
+    def run_replay():
+        try:
+            for thread in busy_threads:
+                thread.start()
+            results['callback'] = replay(client, mqtt_client, stream,
+                                         args.rate, args.settle)
+            results['end'] = time.perf_counter()
+        finally:
+            stop_busy.set()
+            client.stop()
+
+    replay_thread = threading.Thread(target=run_replay, name='replay')
+    replay_thread.start()
+    client.run_app()
+    replay_thread.join()
+    for thread in busy_threads:
+        thread.join()
+
+    if driver is None:
+        writes, daemon_calls = pi.writes, pi.calls
+    else:
+        with open(record_path) as record_file:
+            record = json.load(record_file)
+        writes, daemon_calls = record['writes'], record['calls']
+    # Writes of the shutdown fades are left out
+    writes = sorted(tuple(write) for write in writes
+                    if write[0] <= results['end'])
+
+    callback = results['callback']
+    zone_stats = dict((zone.name or 'default',
+                       dict(zone.stats, publishes=zone.reporter.stats[
+                           'publishes']))
+                      for zone in client.zones)
+    applied = sum(stats['applied'] for stats in zone_stats.values())
+    output = json.dumps({
+        'python': sys.version.split()[0],
+        'messages': len(stream),
+        'rate': args.rate,
+        'zones': args.zones,
+        'batched_fades': args.batched,
+        'driver': args.driver,
+        'busy_threads': args.busy_threads,
+        'callback_latency': dict((key, value) for key, value in
+                                 callback.items()
+                                 if key not in ('seconds', 'deliveries')),
+        'messages_per_second': len(stream) / callback['seconds'],
+        'zone_stats': zone_stats,
+        'pwm_writes': len(writes),
+        'pwm_writes_per_applied': len(writes) / float(applied)
+            if applied else None,
+        'daemon_calls': daemon_calls,
+        'frame_jitter': frame_jitter(writes, lights.FADE_FRAME_INTERVAL,
+                                     callback['deliveries'],
+                                     [set(pins) for pins in pin_groups]),
+    }, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
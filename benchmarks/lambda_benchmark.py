@@ -0,0 +1,256 @@
+"""
+Offline benchmark of the Lambda request path. Replays the recorded Alexa
+events in benchmarks/fixtures through lambda_function.lambda_handler with
+the in-memory IoT shadow backend, so it runs without network or AWS
+credentials.
+
+Reports cold import time of lambda_function, the slowest imports of its
+module graph, warm per invocation p50 and p99 latency and memory allocated
+per request for every fixture, as JSON.
+
+    $ python benchmarks/lambda_benchmark.py --iterations 2000 --output bench.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import tracemalloc
+
+here = os.path.dirname(os.path.abspath(__file__))
+repo = os.path.dirname(here)
+lambda_dir = os.path.join(repo, "lambda_function")
+fixtures_dir = os.path.join(here, "fixtures")
+model_path = os.path.join(repo, "alexa_skill_kit", "interaction_model.json")
+
+# Environment the Lambda runs with during the benchmark
+BENCHMARK_ENV = {
+    "AWS_ALEXA_SKILLS_KIT_ID": "amzn1.ask.skill.benchmark",
+    "AWS_IOT_MY_THING_NAME": "my_painting",
+    "SHADOW_BACKEND": "memory",
+}
+
+COLD_IMPORT_SCRIPT = """
+import sys, time, json
+sys.path.insert(0, {lambda_dir!r})
+start = time.perf_counter()
+import lambda_function
+print(json.dumps({{'seconds': time.perf_counter() - start,
+                   'modules': sorted(sys.modules)}}))
+"""
+
+
+def load_fixtures():
+    """
+    Loads the recorded Alexa events.
+
+    Returns:
+        Python dict of fixture name to event dict
+    """
+    fixtures = {}
+    for filename in sorted(os.listdir(fixtures_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(fixtures_dir, filename)) as fixture_file:
+                fixtures[filename[:-5]] = json.load(fixture_file)
+    return fixtures
+
+def missing_intents(fixtures):
+    """
+    Gives intents of the interaction model without a fixture.
+
+    Args:
+        fixtures: Python dict of fixture name to event dict
+    Returns:
+        list of intent names
+    """
+    with open(model_path) as model_file:
+        intents = [intent['name'] for intent in
+                   json.load(model_file)['languageModel']['intents']]
+    covered = set(event['request']['intent']['name']
+                  for event in fixtures.values()
+                  if event.get('request', {}).get('type') == "IntentRequest")
+    return [name for name in intents if name not in covered]
+
+def measure_cold_import(runs):
+    """
+    Imports lambda_function in fresh interpreters.
+
+    Args:
+        runs: int of interpreters to start
+    Returns:
+        Python dict of import time statistics and modules loaded
+    """
+    env = dict(os.environ, **BENCHMARK_ENV)
+    script = COLD_IMPORT_SCRIPT.format(lambda_dir=lambda_dir)
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, "-c", script],
+                                         env=env, cwd=lambda_dir)
+        results.append(json.loads(output.decode('utf-8').splitlines()[-1]))
+    seconds = sorted(result['seconds'] for result in results)
+    return {
+        'runs': runs,
+        'p50_ms': percentile(seconds, 50) * 1000,
+        'max_ms': seconds[-1] * 1000,
+        'modules_loaded': len(results[-1]['modules']),
+        'boto3_loaded': 'boto3' in results[-1]['modules'],
+    }
+
+def profile_imports(limit):
+    """
+    Profiles the import of lambda_function with -X importtime.
+
+    Args:
+        limit: int of slowest imports to give
+    Returns:
+        list of Python dicts of module and cumulative import time
+    """
+    env = dict(os.environ, **BENCHMARK_ENV)
+    process = subprocess.Popen([sys.executable, "-X", "importtime", "-c",
+                                "import lambda_function"],
+                               env=env, cwd=lambda_dir,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    imports = []
+    for line in stderr.decode('utf-8').splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        imports.append({'module': module.strip(),
+                        'cumulative_us': int(cumulative)})
+    imports.sort(key=lambda item: item['cumulative_us'], reverse=True)
+    return imports[:limit]
+
+def percentile(sorted_values, percent):
+    """
+    Gives the nearest rank percentile of sorted values.
+
+    Args:
+        sorted_values: list of numbers in increasing order
+        percent: number between 0 and 100
+    Returns:
+        number
+    """
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+def measure_warm(lambda_function, event, iterations):
+    """
+    Times warm invocations of the handler with an event. Each invocation
+    gets its own requestId or messageId as a new delivery from Alexa would.
+
+    Args:
+        lambda_function: imported lambda_function module
+        event: Python dict of Alexa event
+        iterations: int of invocations to time
+    Returns:
+        Python dict of latency and allocation statistics
+    """
+    # Keep-warm events have no request, directives have a messageId instead
+    if 'directive' in event:
+        request, id_key = event['directive']['header'], 'messageId'
+    else:
+        request, id_key = event.get('request', {}), 'requestId'
+    request_id = request.get(id_key)
+    # Warm up caches and lazily created clients
+    for index in range(10):
+        request[id_key] = "{}-warmup-{}".format(request_id, index)
+        lambda_function.lambda_handler(event, None)
+
+    timings = []
+    for index in range(iterations):
+        request[id_key] = "{}-{}".format(request_id, index)
+        start = time.perf_counter()
+        lambda_function.lambda_handler(event, None)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    # Allocations are measured separately as tracing slows the handler
+    allocation_runs = min(iterations, 200)
+    tracemalloc.start()
+    peak_bytes = 0
+    blocks_before = sys.getallocatedblocks()
+    for index in range(allocation_runs):
+        request[id_key] = "{}-alloc-{}".format(request_id, index)
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        lambda_function.lambda_handler(event, None)
+        peak_bytes += tracemalloc.get_traced_memory()[1] - baseline
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+    if request_id is not None:
+        request[id_key] = request_id
+
+    return {
+        'iterations': iterations,
+        'p50_us': percentile(timings, 50) * 1e6,
+        'p99_us': percentile(timings, 99) * 1e6,
+        'mean_us': sum(timings) / len(timings) * 1e6,
+        'peak_bytes_per_request': peak_bytes / float(allocation_runs),
+        'retained_blocks_per_request':
+            (blocks_after - blocks_before) / float(allocation_runs),
+    }
+
+def main():
+    """
+    Runs the benchmark and writes the results as JSON.
+
+    Args:
+        None
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--iterations', type=int, default=1000,
+                        help='warm invocations per fixture')
+    parser.add_argument('--cold-runs', type=int, default=5,
+                        help='fresh interpreters to time the import in')
+    parser.add_argument('--import-profile', type=int, default=15,
+                        help='slowest imports to list')
+    parser.add_argument('--log-level', default='WARNING',
+                        help='LOG_LEVEL of the Lambda during the benchmark')
+    parser.add_argument('--cache-ttl', default='0',
+                        help='SHADOW_CACHE_TTL of the Lambda, 0 so repeated '
+                             'events still write the shadow')
+    parser.add_argument('--fixture', action='append',
+                        help='only run the named fixture, may be repeated')
+    parser.add_argument('--output', help='file to write JSON results to')
+    args = parser.parse_args()
+
+    BENCHMARK_ENV['LOG_LEVEL'] = args.log_level
+    BENCHMARK_ENV['SHADOW_CACHE_TTL'] = args.cache_ttl
+    os.environ.update(BENCHMARK_ENV)
+    sys.path.insert(0, lambda_dir)
+    fixtures = load_fixtures()
+    if args.fixture:
+        fixtures = dict((name, fixtures[name]) for name in args.fixture)
+
+    results = {
+        'python': sys.version.split()[0],
+        'missing_intents': missing_intents(load_fixtures()),
+        'cold_import': measure_cold_import(args.cold_runs),
+        'import_profile': profile_imports(args.import_profile),
+        'warm': {},
+    }
+
+    import lambda_function
+    # Handler output goes to CloudWatch in Lambda, keep it off the results
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            for name, event in sorted(fixtures.items()):
+                results['warm'][name] = measure_warm(lambda_function, event,
+                                                     args.iterations)
+        finally:
+            sys.stdout = stdout
+
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
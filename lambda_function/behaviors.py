@@ -1,111 +1,230 @@
 """
 Behaviors the skill will take based on the intent of the request. Calls on
 shadow updater to update IoT shadow accordingly and response builders to
-build a response message. If using sessions, session data should be
-handled here.
+build a response message. Shadow updates are started before the response
+is built and waited on just before returning it. Updates go to the lighting
+zone named in the Zone slot, every zone for "all", or the default zone. If
+using sessions, session data should be handled here.
 """
+import logging
+
+import intent_router
+import metrics
 import response_builders
 import shadow_connection
 
+logger = logging.getLogger(__name__)
+
 # Not using session data or reprompt texts, so these are standard defaults.
 # These should be set in the behaviors functions as they are based on behavior of intent.
 session_attributes = {}
 should_end_session = True
 reprompt_text = None
 
-def get_help_response():
+# Range of color temperatures in Kelvin the lights accept, matching the
+# device's Kelvin table in raspberry_pi/light_values.KELVIN_COLORS
+MIN_KELVIN = 1900
+MAX_KELVIN = 20000
+
+UNKNOWN_ZONE_OUTPUT = "I don't know that painting."
+
+def build_response(card_title, speech_output):
+    """
+    Builds a response message with the standard session defaults, timing
+    it in the ResponseBuild metric.
+
+    Args:
+        card_title: string of card title
+        speech_output: string of output text
+    Returns:
+        Python dict of response message
+    """
+    with metrics.timed('ResponseBuild'):
+        return response_builders.build_response(session_attributes,
+            response_builders.build_speechlet_response(card_title,
+            speech_output, reprompt_text, should_end_session))
+
+def wait_for_update(pending_update):
+    """
+    Waits for a shadow update started by a behavior. An update that failed
+    in time raises its error, as a synchronous update does, so the failure
+    is neither answered with "OK." nor kept as the response to retries.
+
+    Args:
+        pending_update: Future from submit_update or None
+    Raises:
+        Exception of the failed update
+    """
+    if shadow_connection.wait_for_update(pending_update) and \
+            pending_update is not None and \
+            pending_update.exception() is not None:
+        raise pending_update.exception()
+
+@intent_router.handles("AMAZON.HelpIntent")
+def get_help_response(slots=None):
     """
     Builds a help/welcome response.
 
     Args:
-        None
+        slots: Python dict of normalized slot values, unused
     Returns:
         Python dict of response message
     """
     card_title = "Welcome"
     speech_output = "Please give a command for your painting lights."
 
-    response = response_builders.build_response(session_attributes,
-        response_builders.build_speechlet_response(card_title,
-        speech_output, reprompt_text, should_end_session))
+    response = build_response(card_title, speech_output)
     return response
 
-def update_power_state(intent):
+@intent_router.handles("PowerStateIntent")
+def update_power_state(slots):
     """
     Updates power state of IoT shadow. Builds a response confirming the update
-    or requesting the user repeat the query if state is not "ON" or "OFF".
+    or requesting the user repeat the query if state is not "ON" or "OFF" or
+    the zone is not known.
 
     Args:
-        intent: Python dict of intent
+        slots: Python dict of normalized slot values
     Returns:
         Python dict of response message
     """
     card_title = "Power"
+    pending_update = None
 
-    power_state = intent.get('slots',{}).get('PowerState',{}).get('value')
-    if power_state and (power_state.upper() == 'ON' or \
-                        power_state.upper() == 'OFF'):
+    power_state = slots.get('PowerState')
+    shadow_names = shadow_connection.zones_for(slots.get('Zone'))
+    if shadow_names is None:
+        speech_output = UNKNOWN_ZONE_OUTPUT
+    elif power_state:
         speech_output = "OK."
-        new_value_dict = {"power_state":power_state.upper()}
-        shadow_connection.update_shadow(new_value_dict)
+        new_value_dict = {"power_state":power_state}
+        pending_update = shadow_connection.submit_update(new_value_dict,
+                                                             shadow_names)
     else:
         speech_output = "I did not understand that. Please repeat your request."
 
-    response = response_builders.build_response(session_attributes,
-        response_builders.build_speechlet_response(card_title,
-        speech_output, reprompt_text, should_end_session))
+    response = build_response(card_title, speech_output)
+    wait_for_update(pending_update)
     return response
 
-def update_brightness(intent):
+@intent_router.handles("BrightnessIntent")
+def update_brightness(slots):
     """
     Updates brightness of IoT shadow. Builds a response confirming the update
-    or requesting the user repeat the query if 0 <= brightness <= 100. If the
+    or requesting the user repeat the query if 0 <= brightness <= 100 or the
+    zone is not known. If the
     requested brightness is zero, the power state of the shadow will be
     updated to "OFF" and the brightness will not be changed.
 
     Args:
-        intent: Python dict of intent
+        slots: Python dict of normalized slot values
     Returns:
         Python dict of response message
     """
     card_title = "Brightness"
+    pending_update = None
 
-    brightness = intent.get('slots',{}).get('Brightness',{}).get('value')
+    brightness = slots.get('Brightness')
+    shadow_names = shadow_connection.zones_for(slots.get('Zone'))
 
-    if brightness:
-        brightness = int(brightness)
+    if shadow_names is None:
+        speech_output = UNKNOWN_ZONE_OUTPUT
+    elif brightness is not None:
         if brightness > 0 and brightness <= 100:
             speech_output = "Setting brightness to {}.".format(brightness)
             new_value_dict = {"brightness":brightness}
-            shadow_connection.update_shadow(new_value_dict)
+            pending_update = shadow_connection.submit_update(
+                new_value_dict, shadow_names)
         elif brightness == 0:
             speech_output = "Turning off."
             new_value_dict = {"power_state":"OFF"}
-            shadow_connection.update_shadow(new_value_dict)
+            pending_update = shadow_connection.submit_update(
+                new_value_dict, shadow_names)
         else:
             speech_output = "I'm sorry that value is not in the proper range. "\
                 "Please give me a number between 0 and 100."
     else:
         speech_output = "I did not understand that. Please repeat your request."
 
-    response = response_builders.build_response(session_attributes,
-        response_builders.build_speechlet_response(card_title,
-        speech_output, reprompt_text, should_end_session))
+    response = build_response(card_title, speech_output)
+    wait_for_update(pending_update)
     return response
 
-def handle_session_end_request():
+@intent_router.handles("ColorTemperatureIntent")
+def update_color_temperature(slots):
+    """
+    Updates color temperature of IoT shadow, given in Kelvin or as a named
+    light source. Builds a response confirming the update or requesting the
+    user repeat the query if neither is understood, the Kelvin value is
+    out of range or the zone is not known.
+
+    Args:
+        slots: Python dict of normalized slot values
+    Returns:
+        Python dict of response message
+    """
+    card_title = "Color"
+    pending_update = None
+
+    kelvin = slots.get('Kelvin')
+    light_source = slots.get('LightSource')
+    shadow_names = shadow_connection.zones_for(slots.get('Zone'))
+
+    if shadow_names is None:
+        speech_output = UNKNOWN_ZONE_OUTPUT
+    elif kelvin is not None:
+        if kelvin >= MIN_KELVIN and kelvin <= MAX_KELVIN:
+            speech_output = "Setting color temperature to {} Kelvin.".format(kelvin)
+            new_value_dict = {"color_temperature":kelvin}
+            pending_update = shadow_connection.submit_update(
+                new_value_dict, shadow_names)
+        else:
+            speech_output = "I'm sorry that value is not in the proper range. "\
+                "Please give me a number between {} and {} Kelvin.".format(
+                MIN_KELVIN, MAX_KELVIN)
+    elif light_source:
+        speech_output = "OK."
+        new_value_dict = {"color_temperature":light_source}
+        pending_update = shadow_connection.submit_update(new_value_dict,
+                                                             shadow_names)
+    else:
+        speech_output = "I did not understand that. Please repeat your request."
+
+    response = build_response(card_title, speech_output)
+    wait_for_update(pending_update)
+    return response
+
+@intent_router.handles("AMAZON.CancelIntent")
+@intent_router.handles("AMAZON.StopIntent")
+def handle_session_end_request(slots=None):
     """
     Builds a response with a blank message and no session data. If using
     session data this function would specifically have session_attributes = {}
     and should_end_session = True.
 
     Args:
-        None
+        slots: Python dict of normalized slot values, unused
     Returns:
         Python dict of response message
     """
+    card_title = "Goodbye"
     speech_output = None
-    response = response_builders.build_response(session_attributes,
-        response_builders.build_speechlet_response(card_title,
-        speech_output, reprompt_text, should_end_session))
+    response = build_response(card_title, speech_output)
+    return response
+
+@intent_router.handles_unknown
+def handle_unknown_intent(intent_name):
+    """
+    Builds a response for an intent the skill has no behavior for.
+
+    Args:
+        intent_name: string of intent name
+    Returns:
+        Python dict of response message
+    """
+    logger.info("Unknown intent %s", intent_name)
+    card_title = "Unknown"
+    speech_output = "I did not understand that. Please repeat your request."
+
+    response = build_response(card_title, speech_output)
     return response
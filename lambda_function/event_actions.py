@@ -2,7 +2,12 @@
 Actions the skill will take based on event information, including the
 request and the session dicts.
 """
+import logging
+
 import behaviors
+import intent_router
+
+logger = logging.getLogger(__name__)
 
 def on_session_started(session_started_request, session):
     """
@@ -12,8 +17,8 @@ def on_session_started(session_started_request, session):
         session_started_request: Python dict of request
         session: Python dict of session
     """
-    print("on_session_started requestId=" + session_started_request['requestId']
-          + ", sessionId=" + session['sessionId'])
+    logger.info("on_session_started requestId=%s, sessionId=%s",
+                session_started_request['requestId'], session['sessionId'])
     # Update code to handle session information
 
 def on_launch(launch_request, session):
@@ -27,14 +32,14 @@ def on_launch(launch_request, session):
     Returns:
         Python dict of response message
     """
-    print("on_launch requestId=" + launch_request['requestId'] +
-          ", sessionId=" + session['sessionId'])
+    logger.info("on_launch requestId=%s, sessionId=%s",
+                launch_request['requestId'], session['sessionId'])
     return behaviors.get_help_response()
 
 def on_intent(intent_request, session):
     """
-    Called when the user specifies an intent for this skill. Calls a behavior
-    method based on the intent type.
+    Called when the user specifies an intent for this skill. Calls the
+    behavior registered for the intent through the intent router.
 
     Args:
         intent_request: Python dict of request
@@ -42,21 +47,10 @@ def on_intent(intent_request, session):
     Returns:
         Python dict of response message
     """
-    print("on_intent requestId=" + intent_request['requestId'] +
-          ", sessionId=" + session['sessionId'])
-
-    intent = intent_request['intent']
-    intent_name = intent['name']
+    logger.info("on_intent requestId=%s, sessionId=%s",
+                intent_request['requestId'], session['sessionId'])
 
-    if intent_name == "PowerStateIntent":
-        return behaviors.update_power_state(intent)
-    elif intent_name == "BrightnessIntent":
-        return behaviors.update_brightness(intent)
-    elif intent_name == "AMAZON.HelpIntent":
-        return behaviors.get_help_response()
-    elif intent_name == "AMAZON.CancelIntent" or \
-        intent_name == "AMAZON.StopIntent":
-        return behaviors.handle_session_end_request()
+    return intent_router.dispatch(intent_request['intent'])
 
 def on_session_ended(session_ended_request, session):
     """
@@ -64,6 +58,6 @@ def on_session_ended(session_ended_request, session):
 
     Is not called when the skill returns should_end_session=true
     """
-    print("on_session_ended requestId=" + session_ended_request['requestId'] +
-          ", sessionId=" + session['sessionId'])
+    logger.info("on_session_ended requestId=%s, sessionId=%s",
+                session_ended_request['requestId'], session['sessionId'])
     # Update code to handle session information
\ No newline at end of file
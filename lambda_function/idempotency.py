@@ -0,0 +1,212 @@
+"""
+Idempotent handling of requests Alexa delivers more than once. Responses
+are kept by requestId in a bounded least recently used map per warm
+container, so a retried request is answered with the first response and
+updates nothing again.
+
+Retries may reach another container, so responses can also be shared
+through a store named by IDEMPOTENCY_STORE: "dynamodb" keeps them in the
+DynamoDB table IDEMPOTENCY_TABLE, whose partition key is the string
+"requestId", and "memory" is a local stand-in to run without AWS.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+# Responses kept per container, 0 disables the layer
+CACHE_SIZE = int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 256))
+# Name of shared store to use, "none", "memory" or "dynamodb"
+STORE = os.environ.get("IDEMPOTENCY_STORE", "none")
+TABLE = os.environ.get("IDEMPOTENCY_TABLE")
+# Seconds a shared response is kept, Alexa retries within a few seconds
+STORE_TTL = int(os.environ.get("IDEMPOTENCY_STORE_TTL", 300))
+
+# Counters of requests for this container
+stats = {
+    'duplicates': 0,
+    'shared_duplicates': 0,
+}
+
+
+class InMemoryResponseStore(object):
+    """
+    Local stand-in for a shared store of responses by requestId, expiring
+    them after ttl seconds.
+    """
+    def __init__(self, ttl=STORE_TTL):
+        super(InMemoryResponseStore, self).__init__()
+        self.ttl = ttl
+        self.items = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get(self, request_id):
+        """
+        Gives the stored response of a request.
+
+        Args:
+            request_id: string of requestId
+        Returns:
+            Python dict of response, or None if not stored
+        """
+        with self._lock:
+            self.calls += 1
+            item = self.items.get(request_id)
+        if item is None or item[1] <= time.time():
+            return None
+        return json.loads(item[0])
+
+    def put(self, request_id, response):
+        """
+        Stores the response of a request.
+
+        Args:
+            request_id: string of requestId
+            response: Python dict of response
+        """
+        with self._lock:
+            self.calls += 1
+            self.items[request_id] = (json.dumps(response),
+                                      time.time() + self.ttl)
+
+
+class DynamoDBResponseStore(object):
+    """
+    Store of responses by requestId in a DynamoDB table, with an "expires"
+    attribute for the table's time to live.
+    """
+    def __init__(self, table_name=TABLE, ttl=STORE_TTL):
+        super(DynamoDBResponseStore, self).__init__()
+        import boto3
+        self.table = boto3.resource('dynamodb').Table(table_name)
+        self.ttl = ttl
+
+    def get(self, request_id):
+        """
+        Gives the stored response of a request. Items past their time to
+        live may not be deleted yet, so their expiry is checked.
+
+        Args:
+            request_id: string of requestId
+        Returns:
+            Python dict of response, or None if not stored
+        """
+        item = self.table.get_item(Key={'requestId': request_id}).get('Item')
+        if item is None or int(item['expires']) <= time.time():
+            return None
+        return json.loads(item['response'])
+
+    def put(self, request_id, response):
+        """
+        Stores the response of a request.
+
+        Args:
+            request_id: string of requestId
+            response: Python dict of response
+        """
+        self.table.put_item(Item={
+            'requestId': request_id,
+            'response': json.dumps(response),
+            'expires': int(time.time()) + self.ttl,
+        })
+
+
+STORES = {
+    'memory': InMemoryResponseStore,
+    'dynamodb': DynamoDBResponseStore,
+}
+
+# Responses of this container, least recently used first
+_responses = collections.OrderedDict()
+_store = None
+
+def get_store():
+    """
+    Gives the shared store of this container, creating it on first use.
+
+    Returns:
+        store object with get and put, or None if not sharing responses
+    """
+    global _store
+    if _store is None and STORE in STORES:
+        _store = STORES[STORE]()
+    return _store
+
+def set_store(store):
+    """
+    Replaces the shared store, for example with an InMemoryResponseStore.
+
+    Args:
+        store: store object with get and put, or None
+    """
+    global _store
+    _store = store
+
+def lookup(request_id):
+    """
+    Gives the response already given to a request. A response found in the
+    shared store is also kept locally.
+
+    Args:
+        request_id: string of requestId
+    Returns:
+        Python dict of response, or None if the request is new
+    """
+    if not CACHE_SIZE or request_id is None:
+        return None
+    response = _responses.get(request_id)
+    if response is not None:
+        _responses.move_to_end(request_id)
+        stats['duplicates'] += 1
+        return response
+    store = get_store()
+    if store is None:
+        return None
+    try:
+        response = store.get(request_id)
+    except Exception as e:
+        logger.warning("Idempotency store not read: %s", e)
+        return None
+    if response is not None:
+        stats['duplicates'] += 1
+        stats['shared_duplicates'] += 1
+        _keep(request_id, response)
+    return response
+
+def remember(request_id, response):
+    """
+    Keeps the response given to a request, locally and in the shared store.
+
+    Args:
+        request_id: string of requestId
+        response: Python dict of response
+    """
+    if not CACHE_SIZE or request_id is None or response is None:
+        return
+    _keep(request_id, response)
+    store = get_store()
+    if store is None:
+        return
+    try:
+        store.put(request_id, response)
+    except Exception as e:
+        logger.warning("Idempotency store not written: %s", e)
+
+def _keep(request_id, response):
+    """
+    Keeps a response locally, dropping the least recently used one beyond
+    CACHE_SIZE.
+
+    Args:
+        request_id: string of requestId
+        response: Python dict of response
+    """
+    _responses[request_id] = response
+    _responses.move_to_end(request_id)
+    while len(_responses) > CACHE_SIZE:
+        _responses.popitem(last=False)
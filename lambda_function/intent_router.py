@@ -0,0 +1,199 @@
+"""
+Routes intents to their behaviors through tables built once at import from
+the skill's interaction model. Slot values are normalized by slot type
+before reaching a behavior, so behaviors receive ready to use values.
+
+Behaviors register themselves with the handles decorator. Adding an intent
+means adding it to interaction_model.json and decorating its behavior.
+"""
+import os
+import json
+
+import metrics
+
+# Interaction model is looked up next to this module first, as it is copied
+# into the Lambda zip, and then in the alexa_skill_kit directory of the repo.
+_here = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATHS = [
+    os.environ.get("ALEXA_INTERACTION_MODEL_PATH", ""),
+    os.path.join(_here, "interaction_model.json"),
+    os.path.join(_here, os.pardir, "alexa_skill_kit", "interaction_model.json"),
+]
+
+_NUMBER_WORDS = {
+    'zero': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11,
+    'twelve': 12, 'thirteen': 13, 'fourteen': 14, 'fifteen': 15,
+    'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19,
+    'twenty': 20, 'thirty': 30, 'forty': 40, 'fifty': 50, 'sixty': 60,
+    'seventy': 70, 'eighty': 80, 'ninety': 90,
+}
+
+
+def _load_model():
+    """
+    Loads the language model from the first interaction model file found.
+
+    Returns:
+        Python dict of language model
+    Raises:
+        IOError
+    """
+    for path in MODEL_PATHS:
+        if path and os.path.isfile(path):
+            with open(path) as model_file:
+                return json.load(model_file)['languageModel']
+    raise IOError("interaction_model.json not found in {}".format(MODEL_PATHS))
+
+def _parse_number(value):
+    """
+    Parses an AMAZON.NUMBER slot value given as digits or as words such as
+    "fifty five" or "one hundred".
+
+    Args:
+        value: string of slot value
+    Returns:
+        int, or None if value is not a number
+    """
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    total = None
+    for word in value.lower().replace('-', ' ').split():
+        if word in ('a', 'and'):
+            continue
+        if word == 'hundred':
+            total = (total or 1) * 100
+        elif word in _NUMBER_WORDS:
+            total = (total or 0) + _NUMBER_WORDS[word]
+        else:
+            return None
+    return total
+
+def _build_synonym_table(slot_type):
+    """
+    Builds a lookup of lower cased values, ids and synonyms of a custom slot
+    type to their canonical value, the value's id or its value if it has
+    no id.
+
+    Args:
+        slot_type: Python dict of slot type from the language model
+    Returns:
+        Python dict of string to canonical string
+    """
+    table = {}
+    for value in slot_type.get('values', []):
+        name = value['name']
+        canonical = value.get('id') or name['value']
+        for synonym in [canonical, name['value']] + name.get('synonyms', []):
+            if synonym:
+                table[synonym.lower()] = canonical
+    return table
+
+
+_model = _load_model()
+
+# Custom slot types whose unrecognized values are kept as spoken instead of
+# None, so a behavior can tell an unknown value from a missing one. Zones
+# are configured in the Lambda and may be missing from the model.
+PASSTHROUGH_TYPES = ('LIST_OF_ZONES',)
+
+# Slot type name to normalizer taking the raw string value
+_normalizers = {
+    'AMAZON.NUMBER': _parse_number,
+}
+for _slot_type in _model.get('types', []):
+    _normalizers[_slot_type['name']] = \
+        lambda value, table=_build_synonym_table(_slot_type), \
+            passthrough=_slot_type['name'] in PASSTHROUGH_TYPES: \
+            table.get(value.lower(), value if passthrough else None)
+
+# Intent name to list of (slot name, normalizer) pairs
+_intent_slots = dict(
+    (intent['name'], [(slot['name'], _normalizers.get(slot['type']))
+                      for slot in intent.get('slots', [])])
+    for intent in _model['intents'])
+
+# Intent name to behavior
+_handlers = {}
+_fallback = None
+
+
+def handles(intent_name):
+    """
+    Decorator registering a behavior for an intent of the interaction model.
+    The behavior is called with a Python dict of normalized slot values.
+
+    Args:
+        intent_name: string of intent name
+    Returns:
+        Decorator
+    Raises:
+        ValueError
+    """
+    if intent_name not in _intent_slots:
+        raise ValueError("Intent {} is not in the interaction model".format(
+            intent_name))
+    def register(handler):
+        _handlers[intent_name] = handler
+        return handler
+    return register
+
+def handles_unknown(handler):
+    """
+    Decorator registering the behavior answering intents without a handler.
+    The behavior is called with the intent name.
+
+    Args:
+        handler: function taking a string of intent name
+    Returns:
+        handler
+    """
+    global _fallback
+    _fallback = handler
+    return handler
+
+def normalize_slots(intent):
+    """
+    Normalizes the slot values of an intent. Values resolved by Alexa entity
+    resolution are preferred over the spoken value. Missing values are None,
+    as are unrecognized values except of PASSTHROUGH_TYPES, which are kept
+    as spoken.
+
+    Args:
+        intent: Python dict of intent
+    Returns:
+        Python dict of slot name to normalized value
+    """
+    raw_slots = intent.get('slots') or {}
+    slots = {}
+    for name, normalizer in _intent_slots.get(intent['name'], ()):
+        slot = raw_slots.get(name) or {}
+        value = slot.get('value')
+        try:
+            resolution = slot['resolutions']['resolutionsPerAuthority'][0]
+            if resolution['status']['code'] == 'ER_SUCCESS_MATCH':
+                value = resolution['values'][0]['value']['name']
+        except (KeyError, IndexError, TypeError):
+            pass
+        if value is not None and normalizer is not None:
+            value = normalizer(value)
+        slots[name] = value
+    return slots
+
+def dispatch(intent):
+    """
+    Calls the behavior registered for the intent with its normalized slots.
+    Intents without a behavior go to the unknown intent behavior.
+
+    Args:
+        intent: Python dict of intent
+    Returns:
+        Python dict of response message
+    """
+    metrics.set_intent(intent['name'])
+    handler = _handlers.get(intent['name'])
+    if handler is None:
+        return _fallback(intent['name'])
+    return handler(normalize_slots(intent))
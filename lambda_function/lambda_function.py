@@ -2,33 +2,67 @@
 Main lambda function handler. The AWS Lambda function should point here to
 lambda_function.lambda_handler. Acts on request and session information
 through event_actions. Code for sessions is left for reference.
+
+Scheduled keep-warm events, from an EventBridge (CloudWatch Events) rule or
+with a "keep_warm" key, are answered before any other handling. Smart Home
+API v3 directives are handled by smart_home. Requests delivered again with
+the same requestId, or directives with the same messageId, are answered
+with the first response through idempotency.
 """
 import os
+import logging
 
+import metrics
+import smart_home
+import idempotency
 import event_actions
+import shadow_connection
+
+logger = logging.getLogger(__name__)
 
 alexa_id = os.environ.get('AWS_ALEXA_SKILLS_KIT_ID')
 
+# Request type to event action taking the request and session dicts
+request_handlers = {
+    "LaunchRequest": event_actions.on_launch,
+    "IntentRequest": event_actions.on_intent,
+    # Uncomment if storing information in sessions
+    # "SessionEndedRequest": event_actions.on_session_ended,
+}
+
 def lambda_handler(event, context):
     """
     Handles event and request from Alexa Skill by using methods form
-    the event_actions module.
+    the event_actions module, or a Smart Home directive by using the
+    smart_home module. Emits the metrics of the invocation.
 
     Args:
-        event: Python dict of event, request, and session data
+        event: Python dict of event, request, and session data, or of
+            Smart Home directive
         context: LambdaContext containing runtime data
     Returns:
         Python dict of response message
     Rasies:
         ValueError
     """
-    print("event.session.application.applicationId=" +
-          event['session']['application']['applicationId'])
+    if event.get('source') == 'aws.events' or 'keep_warm' in event:
+        return handle_keep_warm()
+
+    if 'directive' in event:
+        directive = event['directive']
+        header = directive['header']
+        return respond("{}.{}".format(header['namespace'], header['name']),
+                       header.get('messageId'),
+                       lambda: smart_home.handle_directive(directive),
+                       failed=smart_home.is_error_response)
+
+    logger.info("event.session.application.applicationId=%s",
+                event['session']['application']['applicationId'])
 
     # Ensure that request is from our skill
     if (event['session']['application']['applicationId'] !=
             alexa_id):
-        print(alexa_id)
+        logger.error("Expected applicationId %s", alexa_id)
         raise ValueError("Invalid Application ID")
 
     # Uncomment if storing information in sessions
@@ -37,11 +71,61 @@ def lambda_handler(event, context):
     #                        event['session'])
 
     request_type = event['request']['type']
+    request_handler = request_handlers.get(request_type)
+    if 'intent' in event['request']:
+        intent_name = event['request']['intent']['name']
+    else:
+        intent_name = None
+    return respond(request_type, event['request'].get('requestId'),
+                   lambda: request_handler(event['request'], event['session'])
+                   if request_handler is not None else None,
+                   intent_name)
 
-    if request_type == "LaunchRequest":
-        return event_actions.on_launch(event['request'], event['session'])
-    elif request_type == "IntentRequest":
-        return event_actions.on_intent(event['request'], event['session'])
-    # Uncomment if storing information in sessions
-    # elif request_type == "SessionEndedRequest":
-    #     return event_actions.on_session_ended(event['request'], event['session'])
+def respond(request_type, request_id, handle, intent_name=None,
+            failed=None):
+    """
+    Answers a request with handle, timing it in the Total and Dispatch
+    metrics. A retried request is answered with the response already given
+    to it, counted in the DuplicateRequests metric. Failed responses are not
+    kept, so a retry after a transient failure is handled again.
+
+    Args:
+        request_type: string of request type, the default Intent dimension
+        request_id: string of requestId or messageId
+        handle: function taking no arguments and giving the response
+        intent_name: string of intent name of a duplicate, or None
+        failed: function taking the response and giving whether it reports
+            a failure, or None if responses never do
+    Returns:
+        Python dict of response message
+    """
+    metrics.start_invocation(request_type)
+    try:
+        with metrics.timed('Total'):
+            response = idempotency.lookup(request_id)
+            if response is not None:
+                logger.info("Duplicate requestId=%s", request_id)
+                if intent_name is not None:
+                    metrics.set_intent(intent_name)
+                metrics.count('DuplicateRequests')
+                return response
+            with metrics.timed('Dispatch'):
+                response = handle()
+            if failed is None or not failed(response):
+                idempotency.remember(request_id, response)
+            return response
+    finally:
+        metrics.emit()
+
+def handle_keep_warm():
+    """
+    Answers a keep-warm event. Creates the shadow backend, importing Boto,
+    so that the next request updating the shadow finds it ready.
+
+    Args:
+        None
+    Returns:
+        Python dict of keep-warm status
+    """
+    shadow_connection.get_backend()
+    return {'warm': True}
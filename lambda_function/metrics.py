@@ -0,0 +1,149 @@
+"""
+Per invocation latency metrics and log configuration of the Lambda.
+
+Timers and counters are collected for the current invocation and emitted as
+one JSON line in CloudWatch Embedded Metric Format, with the intent name as
+a dimension. Shadow workers may still be running when the next invocation
+starts, so each invocation has an id and a worker records its metrics
+against the id of the invocation it works for; metrics of an invocation
+already emitted are dropped. Log verbosity is set with the LOG_LEVEL environment variable;
+modules log with lazy arguments so disabled messages are never formatted.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+
+NAMESPACE = os.environ.get("METRICS_NAMESPACE", "MyPainting")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Lambda configures a handler on the root logger, basicConfig only adds one
+# when running elsewhere.
+logging.basicConfig()
+logging.getLogger().setLevel(LOG_LEVEL)
+
+# Metrics of the current invocation, guarded by _lock
+_timers = {}
+_counts = {}
+_dimensions = {}
+_invocation = 0
+_lock = threading.Lock()
+
+
+def start_invocation(request_type):
+    """
+    Clears the metrics collected for the previous invocation and starts
+    collecting for a new one.
+
+    Args:
+        request_type: string of request type, the default Intent dimension
+    """
+    global _invocation
+    with _lock:
+        _invocation += 1
+        _timers.clear()
+        _counts.clear()
+        _dimensions.clear()
+        _dimensions['Intent'] = request_type
+
+def current_invocation():
+    """
+    Gives the id of the current invocation, for workers to record against.
+
+    Returns:
+        int of invocation id
+    """
+    return _invocation
+
+def set_intent(intent_name):
+    """
+    Sets the Intent dimension of the current invocation.
+
+    Args:
+        intent_name: string of intent name
+    """
+    with _lock:
+        _dimensions['Intent'] = intent_name
+
+def _add(metrics, name, value, invocation):
+    """
+    Adds to a metric of an invocation, if it is still the current one.
+
+    Args:
+        metrics: Python dict of timers or counts
+        name: string of metric name
+        value: number to add
+        invocation: int of invocation id
+    """
+    with _lock:
+        if invocation == _invocation:
+            metrics[name] = metrics.get(name, 0) + value
+
+@contextlib.contextmanager
+def timed(name, invocation=None):
+    """
+    Context manager adding the time spent in it, in milliseconds, to the
+    named timer of an invocation.
+
+    Args:
+        name: string of metric name
+        invocation: int of invocation id, defaults to the current one
+    """
+    if invocation is None:
+        invocation = _invocation
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        _add(_timers, name, elapsed, invocation)
+
+def count(name, value=1, invocation=None):
+    """
+    Adds to the named counter of an invocation.
+
+    Args:
+        name: string of metric name
+        value: int to add
+        invocation: int of invocation id, defaults to the current one
+    """
+    _add(_counts, name, value,
+         _invocation if invocation is None else invocation)
+
+def emit():
+    """
+    Prints the metrics of the current invocation as one line of CloudWatch
+    Embedded Metric Format.
+
+    Returns:
+        Python dict of the metrics document
+    """
+    global _invocation
+    with _lock:
+        # Workers finishing later no longer add to the emitted metrics
+        _invocation += 1
+        timers = dict(_timers)
+        counts = dict(_counts)
+        dimensions = dict(_dimensions)
+    metric_definitions = [{'Name': name, 'Unit': 'Milliseconds'}
+                          for name in timers]
+    metric_definitions.extend({'Name': name, 'Unit': 'Count'}
+                              for name in counts)
+    document = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [list(dimensions)],
+                'Metrics': metric_definitions,
+            }],
+        },
+    }
+    document.update(dimensions)
+    document.update(timers)
+    document.update(counts)
+    # Printed rather than logged so the line is not prefixed by the runtime
+    print(json.dumps(document))
+    return document
@@ -53,4 +53,76 @@ def build_speechlet_response(title, output, reprompt_text, should_end_session):
             }
         },
         'shouldEndSession': should_end_session
-    }
\ No newline at end of file
+    }
+
+# Headers of Smart Home events by (namespace, name), built once and copied
+# into each event with its message ids
+_smart_home_headers = {}
+
+def _smart_home_header(namespace, name):
+    """
+    Gives the pre-built header of a Smart Home event.
+
+    Args:
+        namespace: string of interface namespace
+        name: string of event name
+    Returns:
+        Python dict of header without message ids, not to be modified
+    """
+    header = _smart_home_headers.get((namespace, name))
+    if header is None:
+        header = _smart_home_headers[(namespace, name)] = {
+            'namespace': namespace,
+            'name': name,
+            'payloadVersion': '3',
+        }
+    return header
+
+def build_smart_home_event(namespace, name, message_id,
+                           correlation_token=None, endpoint=None,
+                           payload=None):
+    """
+    Builds a Python dict of a Smart Home API v3 event answering a
+    directive.
+
+    Args:
+        namespace: string of interface namespace
+        name: string of event name
+        message_id: string of unique id of the event
+        correlation_token: string of the directive's correlation token
+        endpoint: Python dict of the directive's endpoint, or None
+        payload: Python dict of event payload, defaults to empty
+    Returns:
+        Python dict of response message
+    """
+    header = dict(_smart_home_header(namespace, name), messageId=message_id)
+    if correlation_token is not None:
+        header['correlationToken'] = correlation_token
+    event = {
+        'header': header,
+        'payload': payload if payload is not None else {}
+    }
+    if endpoint is not None:
+        event['endpoint'] = endpoint
+    return {'event': event}
+
+def build_smart_home_property(namespace, name, value, time_of_sample):
+    """
+    Builds a Python dict of a property for the context of a Smart Home
+    response.
+
+    Args:
+        namespace: string of interface namespace
+        name: string of property name
+        value: value of property
+        time_of_sample: string of ISO 8601 UTC time the value was read
+    Returns:
+        Python dict of property
+    """
+    return {
+        'namespace': namespace,
+        'name': name,
+        'value': value,
+        'timeOfSample': time_of_sample,
+        'uncertaintyInMilliseconds': 0
+    }
@@ -1,25 +1,402 @@
 """
 Handles interactions with AWS IoT Shadow through Boto. Boto is preinstalled
-in AWS Lambda.
+in AWS Lambda. Boto and the background worker are imported when first
+used, so requests that never update the shadow do not pay for their import.
+
+A single shadow transport is kept per warm Lambda container so that the Boto
+client, its resolved endpoint and its kept-alive HTTPS connections are reused
+across invocations. The transport delegates to a backend, which can be swapped
+for the in-memory stand-in to run and time the skill without AWS.
+
+With several lighting zones, each zone is a named shadow of the thing, listed
+in AWS_IOT_SHADOW_ZONES. An update for all zones is sent to every zone's
+shadow concurrently.
+
+The last known state of each shadow is cached in the warm container for
+SHADOW_CACHE_TTL seconds, so commands asking for the state the shadow
+already has return without a shadow write. A write is only skipped when the
+device's reported state is known, from reading the whole shadow, and both
+desired and reported state already hold the values. Update responses keep
+the cache filled, trusting fields not in a response only while shadow
+versions follow on from the cached one.
+
+Skipping is inactive by default, as the reported state is only known once
+the shadow has been read, by a ReportState directive or, with
+SHADOW_CACHE_READ set, on a cache miss before a write. In async mode that
+read runs on the background worker, off the path to the response.
 """
 import os
 import time
 import json
+import logging
+import threading
+
+import metrics
 
-import boto3
+logger = logging.getLogger(__name__)
 
 thingName = os.environ.get("AWS_IOT_MY_THING_NAME")
 host = os.environ.get("AWS_IOT_MQTT_HOST")
 port = os.environ.get("AWS_IOT_MQTT_PORT_UPDATE")
+region = os.environ.get("AWS_IOT_REGION", "us-east-1")
 topic = "$aws/things/{}/shadow/update".format(thingName)
 
-def update_shadow(new_value_dict):
+# Named shadows of the lighting zones, the first being the default zone. If
+# empty, the classic shadow is the only zone.
+ZONES = [zone.strip() for zone in
+         os.environ.get("AWS_IOT_SHADOW_ZONES", "").split(",") if zone.strip()]
+# Zone slot value meaning every zone
+ALL_ZONES = "ALL"
+
+# Transport settings. Timeouts are in seconds.
+CONNECT_TIMEOUT = float(os.environ.get("SHADOW_CONNECT_TIMEOUT", 1))
+READ_TIMEOUT = float(os.environ.get("SHADOW_READ_TIMEOUT", 2))
+MAX_ATTEMPTS = int(os.environ.get("SHADOW_MAX_ATTEMPTS", 2))
+MAX_POOL_CONNECTIONS = int(os.environ.get("SHADOW_MAX_POOL_CONNECTIONS", 4))
+
+# Name of backend to use, "boto" or "memory"
+BACKEND = os.environ.get("SHADOW_BACKEND", "boto")
+
+# Hand shadow updates to a background worker while the response is built.
+# The invocation waits at most UPDATE_DEADLINE seconds for the update.
+ASYNC_UPDATES = os.environ.get("SHADOW_ASYNC_UPDATES", "false").lower() == "true"
+UPDATE_DEADLINE = float(os.environ.get("SHADOW_UPDATE_DEADLINE", 0.3))
+
+# Seconds the cached state of a shadow is trusted, 0 disables the cache.
+# Other writers, such as other containers, can change the shadow unseen for
+# at most this long.
+CACHE_TTL = float(os.environ.get("SHADOW_CACHE_TTL", 10))
+# Read the shadow on a cache miss to find commands that would not change it.
+# Without it no write is skipped unless a ReportState read filled the cache.
+CACHE_READ = os.environ.get("SHADOW_CACHE_READ", "false").lower() == "true"
+
+# Counters of shadow updates for this container
+stats = {
+    'updates': 0,
+    'failures': 0,
+    'deadline_misses': 0,
+    'skipped': 0,
+}
+
+# Stands in for fields missing from the cache
+_MISSING = object()
+
+
+class BotoShadowBackend(object):
+    """
+    Backend sending shadow updates to the IoT Data API with a Boto client
+    configured for connection reuse, explicit timeouts and retries.
+    """
+    def __init__(self):
+        super(BotoShadowBackend, self).__init__()
+        import boto3
+        from botocore.config import Config
+
+        config = Config(connect_timeout=CONNECT_TIMEOUT,
+                        read_timeout=READ_TIMEOUT,
+                        retries={'max_attempts': MAX_ATTEMPTS,
+                                 'mode': 'standard'},
+                        max_pool_connections=MAX_POOL_CONNECTIONS,
+                        tcp_keepalive=True)
+        # Use the account endpoint when known to skip endpoint resolution
+        endpoint_url = "https://{}".format(host) if host else None
+        self.client = boto3.client('iot-data', region,
+                                   endpoint_url=endpoint_url,
+                                   config=config)
+
+    def update_thing_shadow(self, thing_name, payload, shadow_name=None):
+        """
+        Sends the payload to the thing's shadow. The Boto client is thread
+        safe, so updates may be sent concurrently.
+
+        Args:
+            thing_name: string of thing name
+            payload: JSON string of shadow document
+            shadow_name: string of named shadow, or None for classic shadow
+        Returns:
+            Stream-like object with the response document
+        """
+        if shadow_name is None:
+            response = self.client.update_thing_shadow(thingName=thing_name,
+                                                       payload=payload)
+        else:
+            response = self.client.update_thing_shadow(thingName=thing_name,
+                                                       shadowName=shadow_name,
+                                                       payload=payload)
+        return response['payload']
+
+    def get_thing_shadow(self, thing_name, shadow_name=None):
+        """
+        Reads the thing's shadow.
+
+        Args:
+            thing_name: string of thing name
+            shadow_name: string of named shadow, or None for classic shadow
+        Returns:
+            Stream-like object with the shadow document
+        """
+        if shadow_name is None:
+            response = self.client.get_thing_shadow(thingName=thing_name)
+        else:
+            response = self.client.get_thing_shadow(thingName=thing_name,
+                                                    shadowName=shadow_name)
+        return response['payload']
+
+
+class _Payload(object):
+    """
+    Minimal stand-in for the botocore StreamingBody returned by Boto.
+    """
+    def __init__(self, body):
+        self.body = body
+
+    def read(self):
+        return self.body
+
+
+class InMemoryShadowBackend(object):
+    """
+    Local stand-in for the IoT Data API. Merges desired state into an
+    in-memory document per thing and answers like the real service would,
+    with the state of the request and the new version.
+    An optional latency in seconds can be set to simulate a round trip.
+    """
+    def __init__(self, latency=0):
+        super(InMemoryShadowBackend, self).__init__()
+        self.latency = latency
+        self.documents = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def update_thing_shadow(self, thing_name, payload, shadow_name=None):
+        """
+        Merges the payload into the stored document of the thing's shadow.
+
+        Args:
+            thing_name: string of thing name
+            payload: JSON string of shadow document
+            shadow_name: string of named shadow, or None for classic shadow
+        Returns:
+            Stream-like object with the response document
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            document = self.documents.setdefault((thing_name, shadow_name),
+                                                 {'state': {}, 'version': 0})
+            state = json.loads(payload)['state']
+            for section, values in state.items():
+                document['state'].setdefault(section, {}).update(values)
+            document['version'] += 1
+            response = {
+                'state': state,
+                'version': document['version'],
+                'timestamp': int(time.time())
+            }
+        return _Payload(json.dumps(response).encode('utf-8'))
+
+    def get_thing_shadow(self, thing_name, shadow_name=None):
+        """
+        Gives the stored document of the thing's shadow.
+
+        Args:
+            thing_name: string of thing name
+            shadow_name: string of named shadow, or None for classic shadow
+        Returns:
+            Stream-like object with the shadow document
+        Raises:
+            KeyError if the shadow does not exist
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            document = self.documents[(thing_name, shadow_name)]
+            response = {
+                'state': document['state'],
+                'version': document['version'],
+                'timestamp': int(time.time())
+            }
+        return _Payload(json.dumps(response).encode('utf-8'))
+
+
+BACKENDS = {
+    'boto': BotoShadowBackend,
+    'memory': InMemoryShadowBackend,
+}
+
+# Backend shared by every invocation of a warm container
+_backend = None
+
+def get_backend():
+    """
+    Gives the shadow backend of this container, creating it on first use.
+
+    Returns:
+        Shadow backend instance
+    """
+    global _backend
+    if _backend is None:
+        _backend = BACKENDS[BACKEND]()
+    return _backend
+
+def set_backend(backend):
+    """
+    Replaces the shadow backend of this container. Passing None resets it so
+    the next update creates the configured backend.
+
+    Args:
+        backend: Shadow backend instance or None
+    """
+    global _backend
+    _backend = backend
+
+def zones_for(zone):
+    """
+    Gives the shadows to update for a zone slot value. No zone means the
+    default zone and ALL_ZONES means every zone. A zone name that is not
+    configured is not known, rather than taken as the default zone, unless
+    no zones are configured and the classic shadow is the only one.
+
+    Args:
+        zone: string of zone name as resolved or spoken, ALL_ZONES or None
+    Returns:
+        list of shadow names, None standing for the classic shadow, or None
+        if the zone is not known
+    """
+    if zone is None or not ZONES:
+        return ZONES[:1] or [None]
+    if zone == ALL_ZONES:
+        return ZONES
+    for name in ZONES:
+        if name.lower() == zone.lower():
+            return [name]
+    return None
+
+# (thing name, shadow name) to last known state of the shadow
+_cache = {}
+
+def _remember(shadow_name, document, complete):
+    """
+    Caches the state of a shadow from a response. An update response holds
+    only the fields updated, so other cached desired fields are kept only
+    if the response version follows on from the cached one, meaning no
+    other writer changed the shadow in between.
+
+    Args:
+        shadow_name: string of named shadow, or None for classic shadow
+        document: Python dict of response document
+        complete: boolean of whether the document is the whole shadow
+    """
+    if not CACHE_TTL:
+        return
+    key = (thingName, shadow_name)
+    state = document.get('state', {})
+    version = document.get('version')
+    entry = _cache.get(key)
+    if complete:
+        desired = dict(state.get('desired') or {})
+        reported = dict(state.get('reported') or {})
+    elif entry is not None and version is not None and \
+            version == entry['version'] + 1 and \
+            entry['expires'] > time.monotonic():
+        desired = dict(entry['desired'])
+        desired.update(state.get('desired') or {})
+        reported = entry['reported']
+    else:
+        desired = dict(state.get('desired') or {})
+        reported = None
+    _cache[key] = {
+        'desired': desired,
+        # Reported state is only known from reading the whole shadow
+        'reported': reported,
+        'version': version,
+        'expires': time.monotonic() + CACHE_TTL,
+    }
+
+def forget(shadow_name=None):
+    """
+    Drops the cached state of a shadow.
+
+    Args:
+        shadow_name: string of named shadow, or None for classic shadow
+    """
+    _cache.pop((thingName, shadow_name), None)
+
+def read_shadow(shadow_name=None, invocation=None):
+    """
+    Reads a shadow and caches its state.
+
+    Args:
+        shadow_name: string of named shadow, or None for classic shadow
+        invocation: int of invocation id to record metrics against,
+            defaults to the current one
+    Returns:
+        Python dict of shadow document, or None if it could not be read
+    """
+    try:
+        with metrics.timed('ShadowRead', invocation):
+            response_payload = get_backend().get_thing_shadow(thingName,
+                                                              shadow_name)
+        document = json.loads(response_payload.read().decode('utf-8'))
+    except Exception as e:
+        logger.warning("Shadow %s not read: %s", shadow_name, e)
+        return None
+    _remember(shadow_name, document, True)
+    return document
+
+def _is_cached(shadow_name):
+    """
+    Tells whether the state of a shadow is cached and not expired.
+
+    Args:
+        shadow_name: string of named shadow, or None for classic shadow
+    Returns:
+        boolean
+    """
+    entry = _cache.get((thingName, shadow_name))
+    return entry is not None and entry['expires'] > time.monotonic()
+
+def is_redundant(new_value_dict, shadow_name=None):
+    """
+    Tells whether updating a shadow with new_value_dict would change
+    nothing, from its cached state. The reported state must be known and
+    match too, as a device that has not applied the values, or reset since,
+    would only get them from a write's delta.
+
+    Args:
+        new_value_dict: Python dict of values to update in shadow
+        shadow_name: string of named shadow, or None for classic shadow
+    Returns:
+        boolean
+    """
+    if not CACHE_TTL or not _is_cached(shadow_name):
+        return False
+    entry = _cache[(thingName, shadow_name)]
+    if entry['reported'] is None:
+        return False
+    for key, value in new_value_dict.items():
+        if entry['desired'].get(key, _MISSING) != value or \
+                entry['reported'].get(key, _MISSING) != value:
+            return False
+    return True
+
+def update_shadow(new_value_dict, decode_response=True, shadow_name=None,
+                  invocation=None):
     """
     Updates IoT shadow's "desired" state with values from new_value_dict. Logs
-    current "desired" state after update.
+    and caches the "desired" state after update if the response is decoded.
 
     Args:
         new_value_dict: Python dict of values to update in shadow
+        decode_response: boolean to read and parse the response document
+        shadow_name: string of named shadow, or None for classic shadow
+        invocation: int of invocation id to record metrics against,
+            defaults to the current one
+    Returns:
+        Python dict of "desired" state after update, or None if the response
+        is not decoded
     """
     payload_dict = {
         "state": {
@@ -27,9 +404,250 @@ def update_shadow(new_value_dict):
         }
     }
     JSON_payload = json.dumps(payload_dict)
-    shadow_client = boto3.client('iot-data', 'us-east-1')
-    response = shadow_client.update_thing_shadow(thingName=thingName,
-                                                 payload=JSON_payload)
-    res_payload = json.loads(response['payload'].read().decode('utf-8'))
-    print("PowerState: {0}".format(res_payload.get("state").get("desired").get("power_state")))
-    print("Brightness: {0}".format(res_payload.get("state").get("desired").get("brightness")))
+    try:
+        with metrics.timed('ShadowUpdate', invocation):
+            response_payload = get_backend().update_thing_shadow(
+                thingName, JSON_payload, shadow_name)
+    except Exception:
+        # The update may have been applied or not
+        forget(shadow_name)
+        raise
+    if not decode_response:
+        forget(shadow_name)
+        return None
+    res_payload = json.loads(response_payload.read().decode('utf-8'))
+    _remember(shadow_name, res_payload, False)
+    desired = res_payload.get("state").get("desired")
+    logger.info("Shadow: %s", shadow_name)
+    logger.info("PowerState: %s", desired.get("power_state"))
+    logger.info("Brightness: %s", desired.get("brightness"))
+    logger.info("ColorTemperature: %s", desired.get("color_temperature"))
+    return desired
+
+
+# Workers shared by every invocation of a warm container
+_executor = None
+_fanout_executor = None
+
+def _get_executor():
+    """
+    Gives the background worker of this container, creating it on first use.
+
+    Returns:
+        ThreadPoolExecutor
+    """
+    global _executor
+    if _executor is None:
+        import concurrent.futures
+        _executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    return _executor
+
+def _get_fanout_executor():
+    """
+    Gives the workers sending updates of several zones concurrently,
+    creating them on first use. There is one worker per pooled connection.
+
+    Returns:
+        ThreadPoolExecutor
+    """
+    global _fanout_executor
+    if _fanout_executor is None:
+        import concurrent.futures
+        _fanout_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=MAX_POOL_CONNECTIONS)
+    return _fanout_executor
+
+def update_zones(new_value_dict, shadow_names, decode_response=True,
+                 invocation=None):
+    """
+    Updates the "desired" state of each shadow with values from
+    new_value_dict. Several shadows are updated concurrently, so the update
+    takes about as long as updating one.
+
+    Args:
+        new_value_dict: Python dict of values to update in shadow
+        shadow_names: list of shadow names, None for classic shadow
+        decode_response: boolean to read and parse the response documents
+        invocation: int of invocation id to record metrics against,
+            defaults to the current one
+    Returns:
+        list of "desired" states after update, or of None if the responses
+        are not decoded
+    Raises:
+        The first exception of the updates, after all have completed
+    """
+    if invocation is None:
+        invocation = metrics.current_invocation()
+    if len(shadow_names) == 1:
+        return [update_shadow(new_value_dict, decode_response,
+                              shadow_names[0], invocation)]
+    with metrics.timed('ShadowFanout', invocation):
+        futures = [_get_fanout_executor().submit(update_shadow,
+                                                 new_value_dict,
+                                                 decode_response, name,
+                                                 invocation)
+                   for name in shadow_names]
+        return [future.result() for future in futures]
+
+def read_zones(shadow_names, invocation=None):
+    """
+    Reads each shadow. Several shadows are read concurrently.
+
+    Args:
+        shadow_names: list of shadow names, None for classic shadow
+        invocation: int of invocation id to record metrics against,
+            defaults to the current one
+    Returns:
+        list of shadow documents, or of None for shadows not read
+    """
+    if invocation is None:
+        invocation = metrics.current_invocation()
+    if len(shadow_names) == 1:
+        return [read_shadow(shadow_names[0], invocation)]
+    with metrics.timed('ShadowFanout', invocation):
+        futures = [_get_fanout_executor().submit(read_shadow, name,
+                                                 invocation)
+                   for name in shadow_names]
+        return [future.result() for future in futures]
+
+def _on_update_done(future):
+    """
+    Logs and counts a failed background shadow update.
+
+    Args:
+        future: Future of update_shadow call
+    """
+    error = future.exception()
+    if error is not None:
+        stats['failures'] += 1
+        logger.error("Shadow update failed: %r", error)
+
+def _skip_redundant(new_value_dict, shadow_names, read, invocation=None):
+    """
+    Drops the shadows whose cached state shows the update would change
+    nothing, and counts them as skipped.
+
+    Args:
+        new_value_dict: Python dict of values to update in shadow
+        shadow_names: list of shadow names, None for classic shadow
+        read: boolean to first read shadows missing from the cache, if
+            CACHE_READ is set
+        invocation: int of invocation id to record metrics against,
+            defaults to the current one
+    Returns:
+        list of shadow names to update
+    """
+    if read and CACHE_READ and CACHE_TTL:
+        missing = [name for name in shadow_names if not _is_cached(name)]
+        if missing:
+            read_zones(missing, invocation)
+    pending_names = [name for name in shadow_names
+                     if not is_redundant(new_value_dict, name)]
+    skipped = len(shadow_names) - len(pending_names)
+    if skipped:
+        stats['skipped'] += skipped
+        metrics.count('ShadowWritesSkipped', skipped, invocation)
+        logger.info("Skipped %s shadow writes of %s", skipped, new_value_dict)
+    return pending_names
+
+def _update_pending(new_value_dict, shadow_names, invocation):
+    """
+    Background worker side of submit_update. Reads the shadows missing from
+    the cache, if CACHE_READ is set, then updates those the update would
+    change.
+
+    Args:
+        new_value_dict: Python dict of values to update in shadow
+        shadow_names: list of shadow names, None for classic shadow
+        invocation: int of invocation id to record metrics against
+    Returns:
+        list of "desired" states after update
+    """
+    shadow_names = _skip_redundant(new_value_dict, shadow_names, True,
+                                   invocation)
+    if not shadow_names:
+        return []
+    return update_zones(new_value_dict, shadow_names, True, invocation)
+
+def submit_update(new_value_dict, shadow_names=None):
+    """
+    Starts an update of IoT shadow's "desired" state. Shadows whose cached
+    state shows the update would change nothing are skipped. In async mode
+    the update, and any read of shadows missing from the cache, runs on a
+    background worker and a Future is returned to wait on with
+    wait_for_update. Otherwise the update completes before returning.
+
+    Args:
+        new_value_dict: Python dict of values to update in shadow
+        shadow_names: list of shadow names from zones_for, defaults to the
+            default zone
+    Returns:
+        Future of the update, or None if the update has completed or was
+        skipped
+    """
+    if shadow_names is None:
+        shadow_names = zones_for(None)
+    stats['updates'] += 1
+    # Only the cache is checked here in async mode, the worker reads
+    shadow_names = _skip_redundant(new_value_dict, shadow_names,
+                                   not ASYNC_UPDATES)
+    if not shadow_names:
+        return None
+    if not ASYNC_UPDATES:
+        try:
+            update_zones(new_value_dict, shadow_names)
+        except Exception:
+            stats['failures'] += 1
+            metrics.count('ShadowFailures')
+            raise
+        return None
+    # Responses are decoded on the worker to keep the cache filled. Its
+    # metrics are recorded against this invocation, and dropped if it has
+    # ended by the time they are taken.
+    invocation = metrics.current_invocation()
+    future = _get_executor().submit(_update_pending, new_value_dict,
+                                    shadow_names, invocation)
+    future.add_done_callback(_on_update_done)
+    return future
+
+def wait_for_update(future, timeout=None):
+    """
+    Waits for an update started by submit_update to be acknowledged, for at
+    most timeout seconds. An update still running afterwards is left to
+    finish on the worker; note that Lambda freezes the container once the
+    handler returns, so it may complete only when the container next thaws.
+    Missed deadlines and updates that failed in time are counted in the
+    ShadowDeadlineMisses and ShadowFailures metrics.
+
+    Args:
+        future: Future from submit_update or None
+        timeout: float of seconds to wait, defaults to UPDATE_DEADLINE
+    Returns:
+        boolean of whether the update completed in time
+    """
+    if future is None:
+        return True
+    if timeout is None:
+        timeout = UPDATE_DEADLINE
+    import concurrent.futures
+    with metrics.timed('ShadowWait'):
+        done, _ = concurrent.futures.wait([future], timeout=timeout)
+    if not done:
+        stats['deadline_misses'] += 1
+        metrics.count('ShadowDeadlineMisses')
+        logger.warning("Shadow update still pending after %ss", timeout)
+        return False
+    if future.exception() is not None:
+        metrics.count('ShadowFailures')
+    return True
+
+
+# Per invocation latency of shadow updates against the configured backend
+if __name__ == '__main__':
+    runs = 100
+    start = time.time()
+    for i in range(runs):
+        update_shadow({'brightness': i % 100 + 1}, decode_response=False)
+    elapsed = time.time() - start
+    print("{0} backend: {1:.3f} ms per update".format(
+        BACKEND, elapsed / runs * 1000))
@@ -0,0 +1,351 @@
+"""
+Alexa Smart Home API v3 directives, so the lights answer "Alexa, turn on
+the painting" and routines without invoking the custom skill. Handles
+discovery, ReportState, PowerController and BrightnessController.
+
+Each lighting zone is an endpoint, as is the classic shadow when no zones
+are set. With several zones an "All Paintings" endpoint updates every
+zone's shadow concurrently. ReportState is answered from the shadows'
+reported state, as set by the device.
+
+Smart Home directives carry no applicationId; restrict the Lambda's Smart
+Home trigger to the skill id instead.
+"""
+import os
+import time
+import uuid
+import logging
+
+import metrics
+import response_builders
+import shadow_connection
+
+logger = logging.getLogger(__name__)
+
+FRIENDLY_NAME = os.environ.get("SMART_HOME_FRIENDLY_NAME", "Painting")
+MANUFACTURER_NAME = "my_painting"
+
+# Capabilities of every endpoint, as listed in discovery
+CAPABILITIES = [
+    {
+        'type': 'AlexaInterface',
+        'interface': 'Alexa',
+        'version': '3',
+    },
+    {
+        'type': 'AlexaInterface',
+        'interface': 'Alexa.PowerController',
+        'version': '3',
+        'properties': {
+            'supported': [{'name': 'powerState'}],
+            'proactivelyReported': False,
+            'retrievable': True,
+        },
+    },
+    {
+        'type': 'AlexaInterface',
+        'interface': 'Alexa.BrightnessController',
+        'version': '3',
+        'properties': {
+            'supported': [{'name': 'brightness'}],
+            'proactivelyReported': False,
+            'retrievable': True,
+        },
+    },
+]
+
+
+class SmartHomeError(Exception):
+    """
+    Error answered with an Alexa ErrorResponse of a type such as
+    NO_SUCH_ENDPOINT.
+    """
+    def __init__(self, error_type, message):
+        super(SmartHomeError, self).__init__(message)
+        self.error_type = error_type
+
+
+def build_endpoints():
+    """
+    Builds the endpoints of the configured zones.
+
+    Returns:
+        tuple of Python dict of endpointId to list of shadow names, and
+        list of Python dicts of discovery endpoints
+    """
+    thing_name = shadow_connection.thingName
+    named = [(thing_name, FRIENDLY_NAME, [None])]
+    if shadow_connection.ZONES:
+        named = [("{}-{}".format(thing_name, zone),
+                  "{} {}".format(zone.replace('_', ' ').title(),
+                                 FRIENDLY_NAME), [zone])
+                 for zone in shadow_connection.ZONES]
+    if len(shadow_connection.ZONES) > 1:
+        named.append(("{}-{}".format(thing_name,
+                                     shadow_connection.ALL_ZONES),
+                      "All {}s".format(FRIENDLY_NAME),
+                      list(shadow_connection.ZONES)))
+    shadows = dict((endpoint_id, shadow_names)
+                   for endpoint_id, _, shadow_names in named)
+    endpoints = [{
+        'endpointId': endpoint_id,
+        'manufacturerName': MANUFACTURER_NAME,
+        'friendlyName': friendly_name,
+        'description': "Lights of {}".format(friendly_name.lower()),
+        'displayCategories': ['LIGHT'],
+        'capabilities': CAPABILITIES,
+    } for endpoint_id, friendly_name, _ in named]
+    return shadows, endpoints
+
+# Built once per container and shared by every response
+ENDPOINT_SHADOWS, DISCOVERY_ENDPOINTS = build_endpoints()
+
+def now():
+    """
+    Gives the current time as Smart Home properties carry it.
+
+    Returns:
+        string of ISO 8601 UTC time
+    """
+    return time.strftime('%Y-%m-%dT%H:%M:%S.00Z', time.gmtime())
+
+def shadow_names_for(directive):
+    """
+    Gives the shadows of the endpoint a directive is sent to.
+
+    Args:
+        directive: Python dict of directive
+    Returns:
+        list of shadow names, None standing for the classic shadow
+    Raises:
+        SmartHomeError
+    """
+    endpoint_id = directive.get('endpoint', {}).get('endpointId')
+    shadow_names = ENDPOINT_SHADOWS.get(endpoint_id)
+    if shadow_names is None:
+        raise SmartHomeError('NO_SUCH_ENDPOINT',
+                             "No endpoint {}".format(endpoint_id))
+    return shadow_names
+
+def build_response(directive, name='Response', properties=None,
+                   namespace='Alexa', payload=None):
+    """
+    Builds the response event to a directive, timing it in the
+    ResponseBuild metric.
+
+    Args:
+        directive: Python dict of directive
+        name: string of event name
+        properties: list of Python dicts of context properties
+        namespace: string of event namespace
+        payload: Python dict of event payload
+    Returns:
+        Python dict of response message
+    """
+    with metrics.timed('ResponseBuild'):
+        response = response_builders.build_smart_home_event(
+            namespace, name, str(uuid.uuid4()),
+            directive['header'].get('correlationToken'),
+            directive.get('endpoint'), payload)
+        if properties is not None:
+            response['context'] = {'properties': properties}
+        return response
+
+def state_properties(values, time_of_sample):
+    """
+    Builds the context properties of desired or reported shadow values.
+
+    Args:
+        values: Python dict of shadow values
+        time_of_sample: string of ISO 8601 UTC time of the values
+    Returns:
+        list of Python dicts of properties
+    """
+    properties = []
+    if 'power_state' in values:
+        properties.append(response_builders.build_smart_home_property(
+            'Alexa.PowerController', 'powerState', values['power_state'],
+            time_of_sample))
+    if 'brightness' in values:
+        properties.append(response_builders.build_smart_home_property(
+            'Alexa.BrightnessController', 'brightness', values['brightness'],
+            time_of_sample))
+    return properties
+
+def update(directive, new_value_dict):
+    """
+    Updates the "desired" state of the directive's shadows and answers with
+    the new values. A group's shadows are updated concurrently.
+
+    Args:
+        directive: Python dict of directive
+        new_value_dict: Python dict of values to update in shadows
+    Returns:
+        Python dict of response message
+    Raises:
+        SmartHomeError
+    """
+    shadow_names = shadow_names_for(directive)
+    try:
+        pending_update = shadow_connection.submit_update(new_value_dict,
+                                                         shadow_names)
+    except Exception as e:
+        raise SmartHomeError('ENDPOINT_UNREACHABLE', str(e))
+    response = build_response(directive,
+                              properties=state_properties(new_value_dict,
+                                                          now()))
+    if shadow_connection.wait_for_update(pending_update) and \
+            pending_update is not None and \
+            pending_update.exception() is not None:
+        raise SmartHomeError('ENDPOINT_UNREACHABLE',
+                             str(pending_update.exception()))
+    return response
+
+def reported_state(shadow_names):
+    """
+    Reads the state of shadows, the reported values where the device has
+    reported them and the desired values otherwise. A group is on if any of
+    its shadows is, at the brightness of the brightest.
+
+    Args:
+        shadow_names: list of shadow names
+    Returns:
+        Python dict of power state and brightness
+    Raises:
+        SmartHomeError
+    """
+    documents = shadow_connection.read_zones(shadow_names)
+    if None in documents:
+        raise SmartHomeError('ENDPOINT_UNREACHABLE', "Shadow not read")
+    states = []
+    for document in documents:
+        state = dict(document.get('state', {}).get('desired', {}))
+        state.update(document.get('state', {}).get('reported', {}))
+        states.append(state)
+    values = {}
+    power_states = [state['power_state'] for state in states
+                    if 'power_state' in state]
+    if power_states:
+        values['power_state'] = "ON" if "ON" in power_states else "OFF"
+    brightnesses = [state['brightness'] for state in states
+                    if 'brightness' in state]
+    if brightnesses:
+        values['brightness'] = max(brightnesses)
+    return values
+
+def discover(directive):
+    """
+    Lists the endpoints of the zones.
+
+    Args:
+        directive: Python dict of directive
+    Returns:
+        Python dict of response message
+    """
+    return build_response(directive, 'Discover.Response',
+                          namespace='Alexa.Discovery',
+                          payload={'endpoints': DISCOVERY_ENDPOINTS})
+
+def report_state(directive):
+    """
+    Reports the power state and brightness of an endpoint.
+
+    Args:
+        directive: Python dict of directive
+    Returns:
+        Python dict of response message
+    """
+    values = reported_state(shadow_names_for(directive))
+    return build_response(directive, 'StateReport',
+                          properties=state_properties(values, now()))
+
+def turn_on(directive):
+    return update(directive, {"power_state": "ON"})
+
+def turn_off(directive):
+    return update(directive, {"power_state": "OFF"})
+
+def set_brightness(directive):
+    """
+    Sets the brightness of an endpoint. As with the BrightnessIntent, a
+    brightness of zero turns the lights off instead.
+
+    Args:
+        directive: Python dict of directive
+    Returns:
+        Python dict of response message
+    """
+    brightness = directive.get('payload', {}).get('brightness')
+    if not isinstance(brightness, int) or not 0 <= brightness <= 100:
+        raise SmartHomeError('VALUE_OUT_OF_RANGE',
+                             "Brightness {!r} not in 0 to 100".format(
+                                 brightness))
+    if brightness == 0:
+        return update(directive, {"power_state": "OFF"})
+    return update(directive, {"brightness": brightness})
+
+def adjust_brightness(directive):
+    """
+    Changes the brightness of an endpoint by a delta from its current
+    brightness, keeping it within 1 to 100.
+
+    Args:
+        directive: Python dict of directive
+    Returns:
+        Python dict of response message
+    """
+    delta = directive.get('payload', {}).get('brightnessDelta')
+    if not isinstance(delta, int):
+        raise SmartHomeError('INVALID_VALUE',
+                             "Brightness delta {!r}".format(delta))
+    current = reported_state(shadow_names_for(directive)).get('brightness',
+                                                              100)
+    return update(directive,
+                  {"brightness": max(1, min(100, current + delta))})
+
+def is_error_response(response):
+    """
+    Tells whether a response is an Alexa ErrorResponse.
+
+    Args:
+        response: Python dict of response message
+    Returns:
+        boolean
+    """
+    return response['event']['header']['name'] == 'ErrorResponse'
+
+# (namespace, name) of directive to handler taking the directive
+directive_handlers = {
+    ('Alexa.Discovery', 'Discover'): discover,
+    ('Alexa', 'ReportState'): report_state,
+    ('Alexa.PowerController', 'TurnOn'): turn_on,
+    ('Alexa.PowerController', 'TurnOff'): turn_off,
+    ('Alexa.BrightnessController', 'SetBrightness'): set_brightness,
+    ('Alexa.BrightnessController', 'AdjustBrightness'): adjust_brightness,
+}
+
+def handle_directive(directive):
+    """
+    Handles a Smart Home directive. Errors are answered with an Alexa
+    ErrorResponse.
+
+    Args:
+        directive: Python dict of directive
+    Returns:
+        Python dict of response message
+    """
+    header = directive['header']
+    handler = directive_handlers.get((header['namespace'], header['name']))
+    try:
+        if handler is None:
+            raise SmartHomeError('INVALID_DIRECTIVE',
+                                 "Unsupported directive {}.{}".format(
+                                     header['namespace'], header['name']))
+        return handler(directive)
+    except SmartHomeError as e:
+        logger.warning("Directive %s.%s failed: %s", header['namespace'],
+                       header['name'], e)
+        metrics.count('DirectiveErrors')
+        return build_response(directive, 'ErrorResponse',
+                              payload={'type': e.error_type,
+                                       'message': str(e)})
@@ -0,0 +1,58 @@
+"""
+Color temperature lookups. A table of RGB colors for every KELVIN_STEP
+Kelvin is interpolated from the light sources in light_values once at
+import, so a Kelvin value or a light source name maps to RGB in O(1).
+"""
+import light_values
+from light_values import RGB, KELVIN_COLORS
+
+# Resolution of the Kelvin table
+KELVIN_STEP = 10
+MIN_KELVIN = KELVIN_COLORS[0][0]
+MAX_KELVIN = KELVIN_COLORS[-1][0]
+
+# Light source name, as named in light_values, to RGB
+NAMED_COLORS = dict((name, value) for name, value in vars(light_values).items()
+                    if isinstance(value, RGB))
+
+
+def _build_kelvin_table():
+    """
+    Builds the Kelvin table by linear interpolation between the light
+    sources with a Kelvin value.
+
+    Returns:
+        tuple of RGB tuples indexed by (kelvin - MIN_KELVIN) // KELVIN_STEP
+    """
+    table = []
+    anchors = list(zip(KELVIN_COLORS, KELVIN_COLORS[1:]))
+    for kelvin in range(MIN_KELVIN, MAX_KELVIN + 1, KELVIN_STEP):
+        for (low, low_color), (high, high_color) in anchors:
+            if kelvin <= high:
+                break
+        weight = (kelvin - low) / float(high - low)
+        table.append(RGB(*[int(round(a + (b - a) * weight))
+                           for a, b in zip(low_color, high_color)]))
+    return tuple(table)
+
+KELVIN_TABLE = _build_kelvin_table()
+
+
+def color_for(color_temperature):
+    """
+    Gives the color of a color temperature, given as Kelvin or as the name
+    of a light source in light_values. Kelvin values outside of the table
+    are clamped to it.
+
+    Args:
+        color_temperature: int of Kelvin or string of light source name
+    Returns:
+        RGB tuple, or None if color temperature is not known
+    """
+    if isinstance(color_temperature, str):
+        return NAMED_COLORS.get(color_temperature.upper())
+    try:
+        kelvin = min(max(int(color_temperature), MIN_KELVIN), MAX_KELVIN)
+    except (TypeError, ValueError):
+        return None
+    return KELVIN_TABLE[(kelvin - MIN_KELVIN) // KELVIN_STEP]
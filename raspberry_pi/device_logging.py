@@ -0,0 +1,99 @@
+"""
+Logging setup shared by the Raspberry Pi modules. Records are put on a queue
+by the logging thread and written by one listener thread, so slow consoles
+or SD cards never stall the MQTT callback or fades. Records are formatted on
+the listener thread, so callers pass message arguments lazily, as in
+logger.info('Scene %s preempted', name), rather than formatting them first.
+Messages below WARNING are rate limited per logger.
+
+Modules get their logger with get_logger(__name__).
+"""
+import os
+import time
+import atexit
+import logging
+import logging.handlers
+import threading
+import queue
+
+LOG_LEVEL = os.environ.get("MY_PAINTING_LOG_LEVEL", "INFO").upper()
+# Messages per second, and burst of messages, allowed per logger below WARNING
+LOG_RATE = float(os.environ.get("MY_PAINTING_LOG_RATE", 10))
+LOG_BURST = float(os.environ.get("MY_PAINTING_LOG_BURST", 20))
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket filter dropping records below WARNING from a logger once it
+    logs faster than rate messages per second beyond a burst. Counts of
+    dropped records are kept per logger.
+    """
+    def __init__(self, rate=LOG_RATE, burst=LOG_BURST):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self.dropped = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(record.name, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[record.name] = (tokens, now)
+                self.dropped[record.name] = self.dropped.get(record.name, 0) + 1
+                return False
+            self._buckets[record.name] = (tokens - 1, now)
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler leaving records unformatted for the listener thread.
+    """
+    def prepare(self, record):
+        return record
+
+
+_queue = queue.Queue(-1)
+_listener = None
+rate_limit = RateLimitFilter()
+
+
+def _configure():
+    """
+    Starts the listener thread writing queued records to stderr. Called
+    once, by the first get_logger.
+    """
+    global _listener
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(FORMAT))
+    _listener = logging.handlers.QueueListener(_queue, stream_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+def get_logger(name):
+    """
+    Gives a logger writing through the shared queue.
+
+    Args:
+        name: string of logger name
+    Returns:
+        logging.Logger
+    """
+    if _listener is None:
+        _configure()
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        logger.setLevel(LOG_LEVEL)
+        queue_handler = _QueueHandler(_queue)
+        queue_handler.addFilter(rate_limit)
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+    return logger
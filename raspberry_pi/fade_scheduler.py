@@ -0,0 +1,87 @@
+"""
+Deadline based timing of fades. A fade lasts a set duration whatever its
+distance, shown at a set frame rate. Frame n is due at n / frame rate
+seconds after the start on the monotonic clock, so late writes never push
+back the frames after them, and frames whose deadline passed while a write
+ran late are skipped. Progress through the fade is shaped by an easing
+curve.
+
+Durations, frame rate and easing default to MY_PAINTING_FADE_DURATION,
+MY_PAINTING_FADE_FRAME_RATE and MY_PAINTING_FADE_EASING.
+"""
+import os
+import time
+
+# Seconds a fade takes
+FADE_DURATION = float(os.environ.get("MY_PAINTING_FADE_DURATION", 1))
+# Frames shown per second
+FADE_FRAME_RATE = float(os.environ.get("MY_PAINTING_FADE_FRAME_RATE", 50))
+
+
+def linear(progress):
+    return progress
+
+def ease_in(progress):
+    return progress * progress
+
+def ease_out(progress):
+    return 1 - (1 - progress) * (1 - progress)
+
+def ease_in_out(progress):
+    return progress * progress * (3 - 2 * progress)
+
+# Easing name to curve taking and giving progress between 0 and 1
+EASINGS = {
+    'linear': linear,
+    'ease_in': ease_in,
+    'ease_out': ease_out,
+    'ease_in_out': ease_in_out,
+}
+
+FADE_EASING = os.environ.get("MY_PAINTING_FADE_EASING", "ease_in_out")
+
+
+class FadeSchedule(object):
+    """
+    Frames of one fade. Iterating gives (progress, deadline) pairs, the
+    eased progress of the frame to show now and the monotonic time the next
+    frame is due, None after the last frame. Counts the frames skipped.
+    """
+    def __init__(self, duration=None, frame_rate=FADE_FRAME_RATE,
+                 easing=FADE_EASING, clock=time.monotonic):
+        super(FadeSchedule, self).__init__()
+        if duration is None:
+            duration = FADE_DURATION
+        self.frame_rate = float(frame_rate)
+        # Frames after the first, the last one showing the end of the fade
+        self.frames = max(1, int(round(duration * self.frame_rate)))
+        self.interval = 1 / self.frame_rate
+        self.easing = EASINGS[easing] if isinstance(easing, str) else easing
+        self.clock = clock
+        self.skipped = 0
+
+    def progress(self, frame):
+        """
+        Gives the eased progress of a frame.
+
+        Args:
+            frame: int of frame index, 0 to frames
+        Returns:
+            float between 0 and 1
+        """
+        return self.easing(min(frame, self.frames) / float(self.frames))
+
+    def __iter__(self):
+        start = self.clock()
+        frame = 0
+        while True:
+            # Catch up to the frame due now if writes ran late
+            due = int((self.clock() - start) * self.frame_rate)
+            if due > frame:
+                self.skipped += min(due, self.frames) - frame
+                frame = min(due, self.frames)
+            if frame >= self.frames:
+                yield self.progress(self.frames), None
+                return
+            frame += 1
+            yield self.progress(frame - 1), start + frame * self.interval
@@ -0,0 +1,69 @@
+"""
+Precomputed fade tables of gamma corrected duty cycles for the colors in
+light_values. A fade table holds one RGB tuple per brightness level, so a
+fade only indexes into the table instead of computing each frame.
+
+Tables are built once per color and cached. NumPy is used to build them
+when installed, otherwise they are built in pure Python.
+"""
+import light_values
+from light_values import RGB
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Perceived brightness is not linear in duty cycle. Duty cycles are scaled
+# by (brightness / BRIGHTNESS_LEVELS) ** GAMMA.
+GAMMA = 2.2
+# Number of brightness levels above zero, matching the 0-100 shadow range
+BRIGHTNESS_LEVELS = 100
+
+# (color, levels, gamma) to fade table
+_tables = {}
+
+
+def _build_table(color, levels, gamma):
+    """
+    Builds the fade table of a color.
+
+    Args:
+        color: RGB tuple of full brightness color
+        levels: int of brightness levels above zero
+        gamma: float of gamma correction exponent
+    Returns:
+        tuple of RGB tuples indexed by brightness level
+    """
+    if numpy is not None:
+        scale = (numpy.arange(levels + 1) / float(levels)) ** gamma
+        duty = numpy.rint(numpy.outer(scale, color)).astype(int)
+        return tuple(RGB(*row) for row in duty.tolist())
+    table = []
+    for level in range(levels + 1):
+        scale = (level / float(levels)) ** gamma
+        table.append(RGB(*[int(round(value * scale)) for value in color]))
+    return tuple(table)
+
+def get_fade_table(color, levels=BRIGHTNESS_LEVELS, gamma=GAMMA):
+    """
+    Gives the cached fade table of a color, building it on first use.
+
+    Args:
+        color: RGB tuple of full brightness color
+        levels: int of brightness levels above zero
+        gamma: float of gamma correction exponent
+    Returns:
+        tuple of RGB tuples indexed by brightness level
+    """
+    key = (color, levels, gamma)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = _build_table(color, levels, gamma)
+    return table
+
+
+# Build the tables of every color in light_values at import
+for _color in list(vars(light_values).values()):
+    if isinstance(_color, RGB):
+        get_fade_table(_color)
@@ -0,0 +1,228 @@
+"""
+Stand-ins for the pigpio daemon and the AWS IoT MQTT client, so the device
+code can be run and measured on any machine. Pass them to Light and
+MyPaintingMQTTClient in place of pigpio.pi() and AWSIoTMQTTClient:
+
+    pi = FakePi()
+    mqtt_client = LocalMQTTClient()
+    client = MyPaintingMQTTClient(mqtt_client=mqtt_client, pi=pi)
+
+FakePi records every duty cycle written with its time, and LocalMQTTClient
+records publishes and delivers messages to subscribers in process. A FakePi
+in a PWM driver process can write its record to a file when stopped.
+"""
+import re
+import json
+import time
+import threading
+
+# Script states, as in pigpio
+PI_SCRIPT_INITING = 0
+PI_SCRIPT_HALTED = 1
+PI_SCRIPT_RUNNING = 2
+
+# Frame commands of fade scripts built by pwm_output
+_SCRIPT_COMMAND = re.compile(r'(pwm|ld p9|mils) (\d+)(?: (\d+))?')
+
+
+class FakePi(object):
+    """
+    Recording stand-in for a pigpio.pi daemon connection. Writes are kept as
+    (time.perf_counter(), pin, value) tuples. Fade scripts are timed from
+    their mils commands, and the frames played are recorded when stopped.
+    If record_path is given, the writes and daemon calls are written there
+    as JSON when the connection is stopped.
+    """
+    def __init__(self, record_path=None):
+        super(FakePi, self).__init__()
+        self.record_path = record_path
+        self.connected = True
+        self.writes = []
+        self.calls = 0
+        self._scripts = {}
+        self._lock = threading.Lock()
+
+    def set_PWM_dutycycle(self, user_gpio, dutycycle):
+        with self._lock:
+            self.calls += 1
+            self.writes.append((time.perf_counter(), user_gpio, dutycycle))
+        return 0
+
+    def store_script(self, script):
+        """
+        Parses a fade script into frames of (pin, value) writes.
+        """
+        frames = [[]]
+        millis = 0
+        for command, first, second in _SCRIPT_COMMAND.findall(
+                script.decode('ascii')):
+            if command == 'pwm':
+                frames[-1].append((int(first), int(second)))
+            elif command == 'mils':
+                millis = int(first)
+                frames.append([])
+        with self._lock:
+            self.calls += 1
+            script_id = len(self._scripts)
+            self._scripts[script_id] = {'frames': frames,
+                                        'interval': millis / 1000.0,
+                                        'started': None, 'frame': 0}
+        return script_id
+
+    def _frame_reached(self, script):
+        """
+        Gives the index of the frame a running script has reached.
+        """
+        if script['started'] is None:
+            return script['frame']
+        if not script['interval']:
+            return len(script['frames']) - 1
+        elapsed = time.perf_counter() - script['started']
+        return min(int(elapsed / script['interval']),
+                   len(script['frames']) - 1)
+
+    def script_status(self, script_id):
+        script = self._scripts[script_id]
+        frame = self._frame_reached(script)
+        running = script['started'] is not None and \
+            frame < len(script['frames']) - 1
+        params = [0] * 9 + [frame]
+        return (PI_SCRIPT_RUNNING if running else PI_SCRIPT_HALTED, params)
+
+    def run_script(self, script_id, params=None):
+        with self._lock:
+            self.calls += 1
+            self._scripts[script_id]['started'] = time.perf_counter()
+        return 0
+
+    def stop_script(self, script_id):
+        """
+        Stops a script, recording the writes of the frames it played at the
+        times the daemon would have made them.
+        """
+        script = self._scripts[script_id]
+        frame = self._frame_reached(script)
+        with self._lock:
+            self.calls += 1
+            for index, writes in enumerate(script['frames'][:frame + 1]):
+                at = script['started'] + index * script['interval']
+                self.writes.extend((at, pin, value) for pin, value in writes)
+            script['frame'] = frame
+            script['started'] = None
+        return 0
+
+    def delete_script(self, script_id):
+        with self._lock:
+            self.calls += 1
+            del self._scripts[script_id]
+        return 0
+
+    def stop(self):
+        self.connected = False
+        if self.record_path:
+            with self._lock:
+                record = {'writes': self.writes, 'calls': self.calls}
+            with open(self.record_path, 'w') as record_file:
+                json.dump(record, record_file)
+
+
+class MQTTMessage(object):
+    """
+    Message handed to subscription callbacks, like the paho MQTTMessage.
+    """
+    def __init__(self, topic, payload):
+        super(MQTTMessage, self).__init__()
+        self.topic = topic
+        self.payload = payload
+
+
+class LocalMQTTClient(object):
+    """
+    In process stand-in for AWSIoTMQTTClient. Publishes are recorded as
+    (topic, payload) tuples and acknowledged after ack_latency seconds.
+    Messages are delivered to subscribers with deliver.
+    """
+    def __init__(self, clientID=None, ack_latency=0):
+        super(LocalMQTTClient, self).__init__()
+        self.client_id = clientID
+        self.ack_latency = ack_latency
+        self.connected = False
+        self.published = []
+        self.subscriptions = {}
+        self.onOnline = None
+        self.onOffline = None
+        self._mid = 0
+        self._lock = threading.Lock()
+
+    def configureEndpoint(self, hostName, portNumber):
+        pass
+
+    def configureCredentials(self, CAFilePath, KeyPath="", CertificatePath=""):
+        pass
+
+    def configureAutoReconnectBackoffTime(self, baseReconnectQuietTimeSecond,
+                                          maxReconnectQuietTimeSecond,
+                                          stableConnectionTimeSecond):
+        pass
+
+    def configureConnectDisconnectTimeout(self, timeoutSecond):
+        pass
+
+    def configureMQTTOperationTimeout(self, timeoutSecond):
+        pass
+
+    def connect(self, keepAliveIntervalSecond=600):
+        self.connected = True
+        if self.onOnline is not None:
+            self.onOnline()
+        return True
+
+    def disconnect(self):
+        self.connected = False
+        if self.onOffline is not None:
+            self.onOffline()
+        return True
+
+    def publish(self, topic, payload, QoS):
+        with self._lock:
+            self.published.append((topic, payload))
+        return True
+
+    def publishAsync(self, topic, payload, QoS, ackCallback=None):
+        with self._lock:
+            self.published.append((topic, payload))
+            self._mid += 1
+            mid = self._mid
+        if ackCallback is not None:
+            if self.ack_latency:
+                timer = threading.Timer(self.ack_latency, ackCallback, (mid,))
+                timer.daemon = True
+                timer.start()
+            else:
+                ackCallback(mid)
+        return mid
+
+    def subscribe(self, topic, QoS, callback):
+        self.subscriptions[topic] = callback
+        return True
+
+    def unsubscribe(self, topic):
+        self.subscriptions.pop(topic, None)
+        return True
+
+    def deliver(self, topic, payload):
+        """
+        Calls the callback subscribed to topic with a message, on the
+        calling thread as the MQTT client thread would.
+
+        Args:
+            topic: string of topic
+            payload: bytes of message payload
+        Returns:
+            boolean of whether the topic is subscribed
+        """
+        callback = self.subscriptions.get(topic)
+        if callback is None:
+            return False
+        callback(self, None, MQTTMessage(topic, payload))
+        return True
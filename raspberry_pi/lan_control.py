@@ -0,0 +1,298 @@
+"""
+Local control of the lights over HTTP on the LAN, for wall panels and
+scripts. Commands are applied straight to the zone's Light, skipping the
+Alexa, Lambda and IoT round trip, and keep working while the internet is
+down. The new settings reach the shadow through the zone's reporter.
+
+The server runs an asyncio event loop on its own thread. It is enabled by
+setting MY_PAINTING_LAN_PORT.
+
+    $ curl http://raspberrypi:8080/zones
+    $ curl -X POST -d '{"power_state": "ON", "brightness": 40}' \
+        http://raspberrypi:8080/zones/default
+
+Zones are named as in the zones file, "default" being the zone of the
+classic shadow and "all" every zone. If MY_PAINTING_LAN_TOKEN is set,
+requests must send it as "Authorization: Bearer <token>". It must be set
+to listen on any address other than the loopback one, as anyone on the
+network could otherwise control the lights.
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+
+from color_temperature import color_for
+from device_logging import get_logger
+
+lan_host = os.environ.get("MY_PAINTING_LAN_HOST", "0.0.0.0")
+lan_port = os.environ.get("MY_PAINTING_LAN_PORT")
+lan_token = os.environ.get("MY_PAINTING_LAN_TOKEN")
+
+# Addresses only reachable from the Pi itself, where no token is needed
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+# Largest request body accepted, in bytes
+MAX_BODY = 4096
+
+# Seconds a client has to send its request
+REQUEST_TIMEOUT = 5
+
+# Desired state fields a local controller may set, to validators. JSON
+# true and false decode as bools, which are ints to Python.
+FIELDS = {
+    'power_state': lambda value: value in ("ON", "OFF"),
+    'brightness': lambda value: isinstance(value, int) and
+        not isinstance(value, bool) and 0 <= value <= 100,
+    'color_temperature': lambda value: not isinstance(value, bool) and
+        color_for(value) is not None,
+}
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    401: 'Unauthorized',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    408: 'Request Timeout',
+    413: 'Payload Too Large',
+}
+
+# Logger information
+logger = get_logger(__name__)
+
+
+class HTTPError(Exception):
+    """
+    Error answered with an HTTP status.
+    """
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+
+
+def zone_key(zone):
+    """
+    Gives the name a zone is addressed by in paths.
+
+    Args:
+        zone: LightZone
+    Returns:
+        string of zone name
+    """
+    return zone.name or 'default'
+
+def validate(desired):
+    """
+    Checks a request body holds only known desired state fields with valid
+    values.
+
+    Args:
+        desired: decoded JSON request body
+    Raises:
+        HTTPError
+    """
+    if not isinstance(desired, dict) or not desired:
+        raise HTTPError(400, 'Expected a JSON object of settings')
+    for key, value in desired.items():
+        if key not in FIELDS:
+            raise HTTPError(400, 'Unknown setting {}'.format(key))
+        if not FIELDS[key](value):
+            raise HTTPError(400, 'Invalid {} {!r}'.format(key, value))
+
+
+class LanControlServer(object):
+    """
+    Asyncio HTTP server applying desired state to zones. Routes:
+
+        GET /zones           settings of every zone
+        GET /zones/<name>    settings of a zone
+        POST /zones/<name>   apply a JSON object of settings to a zone
+
+    Raises ValueError if no token is given to listen beyond loopback.
+    """
+    def __init__(self, zones, host=lan_host, port=lan_port, token=lan_token):
+        super(LanControlServer, self).__init__()
+        if not token and host not in LOOPBACK_HOSTS:
+            raise ValueError('MY_PAINTING_LAN_TOKEN must be set to listen on '
+                             '{}'.format(host))
+        self.zones = dict((zone_key(zone), zone) for zone in zones)
+        self.host = host
+        self.port = int(port)
+        self.token = token
+        self.stats = {
+            'requests': 0,
+            'errors': 0,
+        }
+        self._loop = asyncio.new_event_loop()
+        self._server = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lan-control')
+        self._thread.daemon = True
+
+    def start(self, timeout=5):
+        """
+        Starts the event loop thread and waits until the server listens.
+
+        Args:
+            timeout: float of seconds to wait for the server
+        Returns:
+            boolean of whether the server is listening
+        """
+        self._thread.start()
+        self._started.wait(timeout)
+        return self._server is not None
+
+    def close(self, timeout=1):
+        """
+        Stops the server and its event loop thread.
+
+        Args:
+            timeout: float of seconds to wait for the thread
+        """
+        if self._thread.is_alive():
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+        logger.info('LAN control: %s', self.stats)
+
+    def _run(self):
+        """
+        Event loop thread. Listens until close is called.
+
+        Args:
+            None
+        """
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, self.host,
+                                     self.port))
+        except OSError as e:
+            logger.error('LAN control not started: %s', e)
+            return
+        finally:
+            self._started.set()
+        logger.info('LAN control listening on %s:%s', self.host, self.port)
+        self._loop.run_forever()
+        self._server.close()
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Answers one request and closes the connection.
+
+        Args:
+            reader: asyncio.StreamReader
+            writer: asyncio.StreamWriter
+        """
+        start = time.perf_counter()
+        self.stats['requests'] += 1
+        try:
+            method, path, headers, body = await asyncio.wait_for(
+                self._read_request(reader), REQUEST_TIMEOUT)
+            status, document = 200, self._route(method, path, headers, body)
+        except HTTPError as e:
+            status, document = e.status, {'error': str(e)}
+        except asyncio.TimeoutError:
+            status, document = 408, {'error': 'Request timed out'}
+        except Exception as e:
+            logger.error(e)
+            status, document = 400, {'error': 'Malformed request'}
+        if status != 200:
+            self.stats['errors'] += 1
+        body = json.dumps(document).encode('utf-8')
+        writer.write('HTTP/1.1 {} {}\r\n'
+                     'Content-Type: application/json\r\n'
+                     'Content-Length: {}\r\n'
+                     'Connection: close\r\n\r\n'.format(
+                         status, REASONS[status], len(body)).encode('ascii'))
+        writer.write(body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+        logger.info('LAN %s %s in %.2f ms', status, document.get('zone', ''),
+                    (time.perf_counter() - start) * 1000)
+
+    async def _read_request(self, reader):
+        """
+        Reads an HTTP request.
+
+        Args:
+            reader: asyncio.StreamReader
+        Returns:
+            tuple of method, path, dict of lower cased headers and bytes of
+            body
+        Raises:
+            HTTPError
+        """
+        request_line = (await reader.readline()).decode('latin-1').split()
+        if len(request_line) != 3:
+            raise HTTPError(400, 'Malformed request line')
+        method, path, _ = request_line
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > MAX_BODY:
+            raise HTTPError(413, 'Body over {} bytes'.format(MAX_BODY))
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), path, headers, body
+
+    def _route(self, method, path, headers, body):
+        """
+        Handles a request.
+
+        Args:
+            method: string of HTTP method
+            path: string of request path
+            headers: Python dict of lower cased headers
+            body: bytes of request body
+        Returns:
+            Python dict of response document
+        Raises:
+            HTTPError
+        """
+        if self.token and headers.get('authorization') != \
+                'Bearer {}'.format(self.token):
+            raise HTTPError(401, 'Missing or wrong token')
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        if not parts or parts[0] != 'zones' or len(parts) > 2:
+            raise HTTPError(404, 'No such path {}'.format(path))
+        if len(parts) == 1:
+            if method != 'GET':
+                raise HTTPError(405, 'Use GET for {}'.format(path))
+            return dict((name, zone.light.current_settings())
+                        for name, zone in self.zones.items())
+
+        name = parts[1]
+        if name == 'all':
+            zones = list(self.zones.values())
+        elif name in self.zones:
+            zones = [self.zones[name]]
+        else:
+            raise HTTPError(404, 'No zone {}'.format(name))
+        if method == 'GET':
+            settings = [zone.light.current_settings() for zone in zones]
+        elif method == 'POST':
+            try:
+                desired = json.loads(body.decode('utf-8'))
+            except ValueError:
+                raise HTTPError(400, 'Body is not JSON')
+            validate(desired)
+            settings = [zone.apply_local(desired) for zone in zones]
+        else:
+            raise HTTPError(405, 'Use GET or POST for {}'.format(path))
+        if name == 'all':
+            return {'zone': name,
+                    'settings': dict((zone_key(zone), zone_settings)
+                                     for zone, zone_settings in
+                                     zip(zones, settings))}
+        return {'zone': name, 'settings': settings[0]}
@@ -54,4 +54,17 @@ NATURALISH = RGB(240,150,20)
 # Warmer, more yellow light
 YELLOWISH = RGB(240,180,20)
 
-MORE_YELLOW = RGB(255,140,10)
\ No newline at end of file
+MORE_YELLOW = RGB(255,140,10)
+
+# Light sources with a Kelvin color temperature, in increasing Kelvin order
+KELVIN_COLORS = (
+    (1900, CANDLE),
+    (2600, TUNGSTEN_40W),
+    (2850, TUNGSTEN_100W),
+    (3200, HALOGEN),
+    (5200, CARBON_ARC),
+    (5400, HIGH_NOON),
+    (6000, DIRECT_SUNLIGHT),
+    (7000, OVERCAST_SKY),
+    (20000, CLEAR_BLUE_SKY),
+)
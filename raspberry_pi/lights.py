@@ -1,13 +1,25 @@
 """
 Logic between the Raspberry Pi and the LED light. Changes maintained through
-the Light object and the pigpio daemon connection.
+the Light object and the pigpio daemon connection. Fades are run by a fade
+engine thread of the Light object, so updating the lights returns at once
+and a new update preempts a fade in progress. Fades take a set duration
+whatever their distance, with frames timed by a FadeSchedule on the
+monotonic clock.
 """
 import time
-import logging
+import threading
 
-import pigpio
+try:
+    import pigpio
+except ImportError:
+    pigpio = None
 
 from light_values import RGB, CANDLE
+from fade_tables import get_fade_table, BRIGHTNESS_LEVELS
+from fade_scheduler import FadeSchedule, FADE_FRAME_RATE, FADE_DURATION
+from color_temperature import color_for
+from pwm_output import PWMOutput
+from device_logging import get_logger
 
 # Respective Gpio ports
 R_PIN = 4
@@ -20,40 +32,80 @@ PINS = RGB(r=R_PIN, g=G_PIN, b=B_PIN)
 # OFF color setting to turn lights off
 OFF = RGB(r=0, g=0, b=0)
 
+# Seconds between fade frames
+FADE_FRAME_INTERVAL = 1 / FADE_FRAME_RATE
+
+# Levels of the fade tables used during fades, finer than the 0-100
+# brightness settings so slow fades do not step visibly
+FADE_LEVELS = 1000
+
+# Longest fade in seconds sent to the pigpio daemon as one script. Longer
+# fades, such as scenes, would make scripts of thousands of frames, so run
+# on the frame loop instead.
+MAX_BATCHED_FADE = 5
+
 # Logger information
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-streamHandler = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-streamHandler.setFormatter(formatter)
-logger.addHandler(streamHandler)
+logger = get_logger(__name__)
+
+def connect_pi():
+    """
+    Connects to the local pigpio daemon.
+
+    Returns:
+        pigpio.pi
+    Raises:
+        ImportError if pigpio is not installed
+    """
+    if pigpio is None:
+        raise ImportError('pigpio is not installed, pass a pi to run '
+                          'without it')
+    return pigpio.pi()
 
 class Light(object):
     """
     Light object to maintian logic of the state of the lights and
     Gpio ports
     """
-    def __init__(self):
+    def __init__(self, pins=PINS, pi=None, batched_fades=False):
         super(Light, self).__init__()
         ## Default start up settings
         self.current_brightness = 100 # current display brightness
         self.brightness = 100 # brightness setting based on shadow
-        self.color = CANDLE
+        self.color = CANDLE # current display color
+        self.color_temperature = 1900 # Kelvin or light source name based on shadow
         self.power_state = "OFF"
 
-        # Establish connection to pigpio daemon
-        self.pi = pigpio.pi()
+        # Establish connection to pigpio daemon unless sharing one
+        self._owns_pi = pi is None
+        self.pi = connect_pi() if pi is None else pi
+        self.output = PWMOutput(self.pi, pins)
+        # Send each fade to the daemon as one script instead of per frame
+        self.batched_fades = batched_fades
+
+        # Fade engine thread, signaled through the condition on new settings
+        self._fade_condition = threading.Condition()
+        self._fade_pending = False
+        # Seconds the pending brightness fade takes, or None for the default
+        self._fade_duration = None
+        self._fade_idle = threading.Event()
+        self._fade_idle.set()
+        self._fade_thread = threading.Thread(target=self._run_fade_engine,
+                                             name='fade-engine')
+        self._fade_thread.daemon = True
+        self._fade_thread.start()
 
     def current_settings(self):
         """
         Gives current settings of Light object.
 
         Returns:
-            Python dict of Light object power state and brightness
+            Python dict of Light object power state, brightness and color
+            temperature
         """
         return {
                    'power_state': self.power_state,
                    'brightness': self.brightness,
+                   'color_temperature': self.color_temperature,
                }
 
     def needs_updating(self, light_data):
@@ -67,85 +119,267 @@ class Light(object):
             boolean
         """
         if light_data.get('brightness') != self.brightness \
-        or light_data.get('power_state') != self.power_state:
+        or light_data.get('power_state') != self.power_state \
+        or light_data.get('color_temperature', self.color_temperature) \
+            != self.color_temperature:
             return True
         return False
 
-    def update_lights(self, light_data):
+    def update_lights(self, light_data, duration=None):
         """
-        Updates Light object needs to update its settings. Sets
-        current brightness to old brightness setting before updating brightness
-        and power_state. Will update brightness and current brightness even
-        if in off state.
+        Updates Light object settings and signals the fade engine to display
+        them. Returns without waiting for the fade. A fade in progress is
+        preempted and the new fade continues from the current brightness.
+        Will update brightness even if in off state.
 
         Args:
             light_data: Python dict of new light data to represent
+            duration: float of seconds the brightness fade takes, or None
+                for FADE_DURATION
+        """
+        with self._fade_condition:
+            self._fade_duration = duration
+            self.brightness = light_data.get('brightness')
+            self.power_state = light_data.get('power_state')
+            self.color_temperature = light_data.get('color_temperature',
+                                                    self.color_temperature)
+            self._fade_pending = True
+            self._fade_idle.clear()
+            self._fade_condition.notify()
+
+    def restore(self, light_data):
+        """
+        Updates Light object settings and displays them at once, with no
+        fade or cross-fade, as the displayed brightness and color are taken
+        to be the settings. Used at start up to light the lights at their
+        stored settings.
+
+        Args:
+            light_data: Python dict of light data to represent
+        """
+        with self._fade_condition:
+            self._fade_duration = None
+            self.brightness = light_data.get('brightness')
+            self.power_state = light_data.get('power_state')
+            self.color_temperature = light_data.get('color_temperature',
+                                                    self.color_temperature)
+            self.color = color_for(self.color_temperature) or self.color
+            self.current_brightness = self.brightness
+            self._fade_pending = True
+            self._fade_idle.clear()
+            self._fade_condition.notify()
+
+    def wait_for_fade(self, timeout=None):
+        """
+        Blocks until the fade engine has displayed the latest settings.
+
+        Args:
+            timeout: float of seconds to wait, or None to wait indefinitely
         Returns:
-            boolean
+            boolean of whether the fade engine is idle
         """
-        self.current_brightness = self.brightness
-        self.brightness = light_data.get('brightness')
-        self.power_state = light_data.get('power_state')
-        self._update_board()
+        return self._fade_idle.wait(timeout)
 
-    def _update_board(self):
+    def close(self):
         """
-        Updates light brightness if power state is on. Otherwise sets the
-        lights to OFF color. Logs current settings after updating.
+        Turns the lights off, waiting at most a second for the fade engine,
+        and closes the pigpio daemon connection if not shared.
 
         Args:
             None
         """
+        self.update_lights({'power_state': "OFF",
+                            'brightness': self.brightness})
+        self.wait_for_fade(1)
+        if self._owns_pi:
+            self.pi.stop()
+
+    def _run_fade_engine(self):
+        """
+        Fade engine loop. Waits for new settings and updates the board to
+        them. Runs on the fade engine thread for the life of the Light.
+
+        Args:
+            None
+        """
+        while True:
+            with self._fade_condition:
+                while not self._fade_pending:
+                    self._fade_condition.wait()
+                self._fade_pending = False
+                duration = self._fade_duration
+            try:
+                self._update_board(duration)
+            except Exception as e:
+                logger.error(e)
+            with self._fade_condition:
+                if not self._fade_pending:
+                    self._fade_idle.set()
+
+    def _update_board(self, duration=None):
+        """
+        Updates light color and brightness if power state is on. Otherwise
+        sets the lights to OFF color. Logs current settings and the pigpio
+        daemon calls made after updating.
+
+        Args:
+            duration: float of seconds the brightness fade takes, or None
+                for FADE_DURATION
+        """
+        color = color_for(self.color_temperature)
+        if color is None:
+            logger.error('Unknown color temperature %s',
+                         self.color_temperature)
+            color = self.color
         if self.power_state == "ON":
+            # Cross-fade to a new color at current brightness first. A timed
+            # fade changing brightness too gives half its duration to each.
+            if color != self.color:
+                if duration is not None and \
+                        self.brightness != self.current_brightness:
+                    duration = duration / 2.
+                self._cross_fade(color, duration)
+                if self._fade_pending:
+                    return
             # Only update brightness if on. Will adjust from most recent brightness level.
-            self._update_brightness()
+            fade_duration = FADE_DURATION if duration is None else duration
+            if self.batched_fades and fade_duration <= MAX_BATCHED_FADE:
+                self._play_brightness_fade(duration)
+            else:
+                self._update_brightness(duration)
         else:
             # Case where called to switch off
+            self.color = color
             self._update_color(OFF)
         logger.info(self.power_state)
         logger.info(self.brightness)
+        logger.info('pigpio calls: %s', self.output.take_daemon_calls())
 
-    def _update_brightness(self):
+    def _wait_until(self, deadline):
         """
-        Adjusts brightness level incrementally. Will begin from current
-        brightness even if brightness change in off state. Gradually
-        changes current brightness until equal to brightness setting
-        updating the lights with each change.
+        Waits until the monotonic clock reaches deadline, or new settings
+        are signaled.
 
         Args:
-            None
+            deadline: float of time.monotonic() to wait until
+        Returns:
+            boolean of whether new settings were signaled
+        """
+        with self._fade_condition:
+            while not self._fade_pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._fade_condition.wait(remaining)
+            return self._fade_pending
+
+    def _fade_index(self, level):
+        """
+        Gives the index of a brightness level in FADE_LEVELS fade tables.
+
+        Args:
+            level: float of brightness level between 0 and 100
+        Returns:
+            int of fade table index
+        """
+        return int(round(level * FADE_LEVELS / BRIGHTNESS_LEVELS))
+
+    def _update_brightness(self, duration=None):
         """
-        while self.current_brightness != self.brightness:
-            next_color = RGB(r=int(self.color.r * (self.current_brightness/100.0)),
-                             g=int(self.color.g * (self.current_brightness/100.0)),
-                             b=int(self.color.b * (self.current_brightness/100.0)))
-            self._update_color(next_color)
-            diff = self.brightness - self.current_brightness
-            # adjust current brightness to +/- 1
-            self.current_brightness = self.current_brightness + \
-                (diff) / abs(diff)
-            time.sleep(.05)
+        Fades from current brightness to the brightness setting. Will begin
+        from current brightness even if brightness change in off state.
+        Each frame shows the level eased between both at the frame's time,
+        so the fade takes the same time however far it moves and ends on
+        time even if writes run late. Stops early when new settings are
+        signaled so the fade engine can start the next fade, leaving
+        current brightness at the level reached. Colors are looked up in the
+        gamma corrected fade table of the current color.
+
+        Args:
+            duration: float of seconds the fade takes, or None for
+                FADE_DURATION
+        """
+        target = self.brightness
+        start = self.current_brightness
+        if start != target:
+            fade_table = get_fade_table(self.color, FADE_LEVELS)
+            schedule = FadeSchedule(duration)
+            for progress, deadline in schedule:
+                if self._fade_pending:
+                    return
+                level = start + (target - start) * progress
+                self._update_color(fade_table[self._fade_index(level)])
+                self.current_brightness = int(round(level))
+                if deadline is None:
+                    break
+                if self._wait_until(deadline):
+                    return
+            if schedule.skipped:
+                logger.info('Skipped frames: %s', schedule.skipped)
         # Final update to exact brightness and default if no change in brightness setting
-        final_color = RGB(r=int(self.color.r * (self.brightness/100.0)),
-                          g=int(self.color.g * (self.brightness/100.0)),
-                          b=int(self.color.b * (self.brightness/100.0)))
-        self._update_color(final_color)
+        self.current_brightness = target
+        self._update_color(get_fade_table(self.color)[target])
+
+    def _cross_fade(self, color, duration=None):
+        """
+        Cross-fades from current color to color at current brightness,
+        timed like brightness fades. Stops early when new settings are
+        signaled.
+
+        Args:
+            color: RGB tuple of new color
+            duration: float of seconds the cross-fade takes, or None for
+                FADE_DURATION
+        """
+        start = get_fade_table(self.color)[self.current_brightness]
+        end = get_fade_table(color)[self.current_brightness]
+        self.color = color
+        for progress, deadline in FadeSchedule(duration):
+            if self._fade_pending:
+                return
+            self._update_color(RGB(*[int(round(a + (b - a) * progress))
+                                     for a, b in zip(start, end)]))
+            if deadline is None or self._wait_until(deadline):
+                return
+
+    def _play_brightness_fade(self, duration=None):
+        """
+        Fades brightness like _update_brightness, but sends the whole fade
+        to the pigpio daemon as one script. Waits for the fade to finish or
+        for new settings to be signaled, then sets current brightness to
+        the level the script reached.
+
+        Args:
+            duration: float of seconds the fade takes, or None for
+                FADE_DURATION
+        """
+        target = self.brightness
+        start = self.current_brightness
+        if start == target:
+            self._update_color(get_fade_table(self.color)[target])
+            return
+        fade_table = get_fade_table(self.color, FADE_LEVELS)
+        schedule = FadeSchedule(duration)
+        levels = [start + (target - start) * schedule.progress(frame)
+                  for frame in range(schedule.frames + 1)]
+        self.output.play_fade([fade_table[self._fade_index(level)]
+                               for level in levels], schedule.interval)
+        self._wait_until(time.monotonic() +
+                         schedule.frames * schedule.interval)
+        self.current_brightness = int(round(levels[self.output.stop_fade()]))
+        if not self._fade_pending:
+            self._update_color(get_fade_table(self.color)[target])
 
     def _update_color(self, rgb_tuple):
         """
-        Sets lights to color in rgb_tuple by setting all RGB gpio ports to
-        the respective color.
+        Sets lights to color in rgb_tuple by setting the RGB gpio ports whose
+        duty cycle changed. Colors come from fade tables and light_values so
+        are already between 0 and 255.
 
         Args:
             rgb_tuple: RGB tuple of colors to represent
         """
-        for color in rgb_tuple._fields:
-            pin = getattr(PINS, color)
-            value = getattr(rgb_tuple, color)
-            # Ensure color between 0 and 255
-            value = max(min(value, 255), 0)
-            # print(pin, value)
-            self.pi.set_PWM_dutycycle(pin, value)
+        self.output.write(rgb_tuple)
 
 
 # Demo of fade effect for lights
@@ -158,27 +392,32 @@ if __name__ == '__main__':
         'brightness': 100,
     }
     light.update_lights(light_data_0)
+    light.wait_for_fade()
     time.sleep(1)
     light_data_1 = {
         'power_state': "ON",
         'brightness': 50,
     }
     light.update_lights(light_data_1)
+    light.wait_for_fade()
     time.sleep(1)
     light_data_2 = {
         'power_state': "ON",
         'brightness': 10,
     }
     light.update_lights(light_data_2)
+    light.wait_for_fade()
     time.sleep(1)
     light_data_3 = {
         'power_state': "ON",
         'brightness': 100,
     }
     light.update_lights(light_data_3)
+    light.wait_for_fade()
     time.sleep(1)
     light_data_4 = {
         'power_state': "OFF",
         'brightness': 100,
     }
-    light.update_lights(light_data_4)
\ No newline at end of file
+    light.update_lights(light_data_4)
+    light.wait_for_fade()
\ No newline at end of file
@@ -0,0 +1,397 @@
+"""
+Optional isolated PWM driver. One small process owns the pigpio daemon
+connection and runs the fade engine of every zone's Light, so fade timing
+no longer competes for the GIL with the MQTT client threads, JSON parsing
+and logging of the control process. Enabled by setting
+MY_PAINTING_DRIVER=process.
+
+The control process hands each zone's target settings to the driver
+through a slot in a multiprocessing.shared_memory block. A slot is written
+by one process only and guarded by a sequence number, odd while a write is
+in progress, so neither side ever takes a lock the other holds. The driver
+is woken by a byte on a pipe, and writes back the generation of the last
+command whose fade has finished.
+
+DriverLight stands in for Light in the control process:
+
+    driver = PWMDriver([zone['pins'] for zone in load_zone_config()])
+    light = driver.lights[0]
+"""
+import os
+import math
+import time
+import struct
+import threading
+import multiprocessing
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+from light_values import RGB
+from lights import Light, connect_pi
+from device_logging import get_logger
+
+# "thread" runs fades in the control process, "process" in a PWM driver
+driver_mode = os.environ.get("MY_PAINTING_DRIVER", "thread")
+
+# Sequence number of a slot, odd while being written
+SEQUENCE = struct.Struct('<I')
+# Bytes of a light source name in a command
+NAME_SIZE = 32
+# Command of a slot: generation, power on, brightness (255 for None),
+# Kelvin (-1 for a light source), light source name, fade seconds (NaN
+# for the default)
+COMMAND = struct.Struct('<IBBi{}sd'.format(NAME_SIZE))
+# Generation of the last command whose fade has finished
+DONE = struct.Struct('<I')
+
+# Bytes of the header, holding the stop flag, and of each zone's slot
+HEADER_SIZE = 8
+SLOT_SIZE = 64
+DONE_OFFSET = 56
+
+NO_BRIGHTNESS = 255
+LIGHT_SOURCE = -1
+# Fade seconds of a command to display its settings at once, as restored
+SHOW_AT_ONCE = -1.0
+
+# Seconds between checks of a fade finishing, in both processes
+WAIT_INTERVAL = .01
+
+# Round robin real time priority of the driver, 0 to leave it as others.
+# Needs root or CAP_SYS_NICE, without which the driver runs at the default
+# priority.
+driver_priority = int(os.environ.get("MY_PAINTING_DRIVER_PRIORITY", 10))
+
+# Logger information
+logger = get_logger(__name__)
+
+
+def encode_command(generation, settings, duration):
+    """
+    Packs light settings into the fields of a slot's command. Numbers
+    given as floats, as JSON allows, are truncated to ints.
+
+    Args:
+        generation: int of command generation
+        settings: Python dict of light settings
+        duration: float of fade seconds, None for the default or
+            SHOW_AT_ONCE
+    Returns:
+        tuple of command fields
+    Raises:
+        ValueError if a setting does not fit the command
+    """
+    brightness = settings.get('brightness')
+    color_temperature = settings.get('color_temperature')
+    try:
+        if isinstance(color_temperature, str):
+            kelvin, name = LIGHT_SOURCE, color_temperature.encode('ascii')
+            if len(name) > NAME_SIZE:
+                raise ValueError('longer than {} bytes'.format(NAME_SIZE))
+        else:
+            kelvin, name = int(color_temperature), b''
+        if brightness is not None:
+            brightness = int(brightness)
+            if not 0 <= brightness < NO_BRIGHTNESS:
+                raise ValueError('brightness out of range')
+    except (TypeError, ValueError) as e:
+        raise ValueError('Settings {} not sent to driver: {}'.format(
+            settings, e))
+    return (generation,
+            settings.get('power_state') == "ON",
+            NO_BRIGHTNESS if brightness is None else brightness,
+            kelvin, name,
+            float('nan') if duration is None else duration)
+
+def decode_command(fields):
+    """
+    Unpacks the fields of a slot's command.
+
+    Args:
+        fields: tuple of command fields
+    Returns:
+        tuple of int of generation, Python dict of light settings and float
+        of fade seconds or None
+    """
+    generation, power, brightness, kelvin, name, duration = fields
+    return generation, {
+        'power_state': "ON" if power else "OFF",
+        'brightness': None if brightness == NO_BRIGHTNESS else brightness,
+        'color_temperature': name.rstrip(b'\0').decode('ascii')
+            if kelvin == LIGHT_SOURCE else kelvin,
+    }, None if math.isnan(duration) else duration
+
+
+class CommandSlots(object):
+    """
+    The zone slots of a shared memory buffer. Commands are written by the
+    control process and read by the driver, done generations the other way.
+    """
+    def __init__(self, buffer, zones):
+        super(CommandSlots, self).__init__()
+        self.buffer = buffer
+        self.zones = zones
+        self._sequences = [0] * zones
+
+    @staticmethod
+    def size(zones):
+        return HEADER_SIZE + zones * SLOT_SIZE
+
+    def write(self, index, fields):
+        """
+        Writes a zone's command. Only one thread may write a slot at once.
+
+        Args:
+            index: int of zone index
+            fields: tuple of command fields
+        """
+        offset = HEADER_SIZE + index * SLOT_SIZE
+        sequence = self._sequences[index]
+        SEQUENCE.pack_into(self.buffer, offset, sequence + 1)
+        COMMAND.pack_into(self.buffer, offset + SEQUENCE.size, *fields)
+        SEQUENCE.pack_into(self.buffer, offset, sequence + 2)
+        self._sequences[index] = sequence + 2
+
+    def read(self, index):
+        """
+        Reads a zone's command, retrying while it is being written.
+
+        Args:
+            index: int of zone index
+        Returns:
+            tuple of command fields
+        """
+        offset = HEADER_SIZE + index * SLOT_SIZE
+        while True:
+            before = SEQUENCE.unpack_from(self.buffer, offset)[0]
+            if not before & 1:
+                fields = COMMAND.unpack_from(self.buffer,
+                                             offset + SEQUENCE.size)
+                if SEQUENCE.unpack_from(self.buffer, offset)[0] == before:
+                    return fields
+            time.sleep(0)
+
+    def set_done(self, index, generation):
+        DONE.pack_into(self.buffer, HEADER_SIZE + index * SLOT_SIZE +
+                       DONE_OFFSET, generation)
+
+    def done(self, index):
+        return DONE.unpack_from(self.buffer, HEADER_SIZE +
+                                index * SLOT_SIZE + DONE_OFFSET)[0]
+
+    def stop(self):
+        SEQUENCE.pack_into(self.buffer, 0, 1)
+
+    def stopped(self):
+        return SEQUENCE.unpack_from(self.buffer, 0)[0] == 1
+
+
+def run_driver(memory_name, wakeup, pin_groups, pi_factory, batched_fades):
+    """
+    Driver process. Applies each zone's newest command to its Light as it
+    arrives, and marks commands done once their fade has finished. Turns
+    the lights off and exits when stopped or when the control process is
+    gone.
+
+    Args:
+        memory_name: string of shared memory block name
+        wakeup: multiprocessing Connection read end of the wakeup pipe
+        pin_groups: list of tuples of RGB pins of each zone
+        pi_factory: function taking no arguments and giving a pigpio.pi
+        batched_fades: boolean to send brightness fades as pigpio scripts
+    """
+    if driver_priority:
+        try:
+            os.sched_setscheduler(0, os.SCHED_RR,
+                                  os.sched_param(driver_priority))
+        except (AttributeError, OSError) as e:
+            logger.warning('PWM driver left at default priority: %s', e)
+    memory = shared_memory.SharedMemory(name=memory_name)
+    slots = CommandSlots(memory.buf, len(pin_groups))
+    pi = pi_factory()
+    lights = [Light(RGB(*pins), pi, batched_fades) for pins in pin_groups]
+    applied = [0] * len(lights)
+    done = [0] * len(lights)
+    try:
+        while not slots.stopped():
+            fading = applied != done
+            if wakeup.poll(WAIT_INTERVAL if fading else None):
+                if not os.read(wakeup.fileno(), 4096):
+                    logger.info('Control process gone, stopping driver')
+                    break
+            for index, light in enumerate(lights):
+                generation, settings, duration = decode_command(
+                    slots.read(index))
+                if generation != applied[index]:
+                    if duration == SHOW_AT_ONCE:
+                        light.restore(settings)
+                    else:
+                        light.update_lights(settings, duration)
+                    applied[index] = generation
+                if done[index] != applied[index] and light.wait_for_fade(0):
+                    done[index] = applied[index]
+                    slots.set_done(index, done[index])
+    finally:
+        for light in lights:
+            light.close()
+        pi.stop()
+        memory.close()
+
+
+class PWMDriver(object):
+    """
+    Control side of the PWM driver process. Starts the driver with a
+    shared memory slot per zone and gives a DriverLight per zone.
+    """
+    def __init__(self, pin_groups, pi_factory=connect_pi,
+                 batched_fades=False):
+        super(PWMDriver, self).__init__()
+        if shared_memory is None:
+            raise ImportError('multiprocessing.shared_memory needs Python '
+                              '3.8, use MY_PAINTING_DRIVER=thread')
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=CommandSlots.size(len(pin_groups)))
+        self.slots = CommandSlots(self.memory.buf, len(pin_groups))
+        reader, self._wakeup = multiprocessing.Pipe(duplex=False)
+        os.set_blocking(self._wakeup.fileno(), False)
+        # Spawned, as forking would copy the MQTT client threads' locks
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target=run_driver, name='pwm-driver',
+            args=(self.memory.name, reader,
+                  [tuple(pins) for pins in pin_groups], pi_factory,
+                  batched_fades))
+        self.process.daemon = True
+        self.process.start()
+        reader.close()
+        self.lights = [DriverLight(self, index, pins)
+                       for index, pins in enumerate(pin_groups)]
+
+    def send(self, index, fields):
+        """
+        Writes a zone's command and wakes the driver.
+
+        Args:
+            index: int of zone index
+            fields: tuple of command fields
+        """
+        self.slots.write(index, fields)
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup.fileno(), b'\0')
+        except BlockingIOError:
+            # The driver has wakeups pending and reads the slots anyway
+            pass
+        except BrokenPipeError:
+            logger.error('PWM driver is not running')
+
+    def close(self, timeout=2):
+        """
+        Stops the driver, which turns the lights off, and frees the shared
+        memory.
+
+        Args:
+            timeout: float of seconds to wait for the driver to exit
+        """
+        self.slots.stop()
+        self._wake()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logger.error('PWM driver did not stop, terminating it')
+            self.process.terminate()
+        self._wakeup.close()
+        self.memory.close()
+        self.memory.unlink()
+
+
+class DriverLight(object):
+    """
+    Light of a zone rendered by the PWM driver process. Keeps the settings
+    like a Light, and hands each update to the driver instead of a fade
+    engine thread.
+    """
+    # Settings logic is the Light's, on the settings kept here
+    current_settings = Light.current_settings
+    needs_updating = Light.needs_updating
+
+    def __init__(self, driver, index, pins):
+        super(DriverLight, self).__init__()
+        ## Default start up settings, as of Light
+        self.brightness = 100
+        self.color_temperature = 1900
+        self.power_state = "OFF"
+
+        self.driver = driver
+        self.index = index
+        self.pins = pins
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def update_lights(self, light_data, duration=None):
+        """
+        Updates DriverLight settings and hands them to the driver. Returns
+        without waiting for the fade. Settings that can not be sent are
+        not kept, so the DriverLight still matches the driver.
+
+        Args:
+            light_data: Python dict of new light data to represent
+            duration: float of seconds the brightness fade takes, or None
+                for FADE_DURATION
+        Raises:
+            ValueError if a setting does not fit a driver command
+        """
+        with self._lock:
+            settings = {
+                'power_state': light_data.get('power_state'),
+                'brightness': light_data.get('brightness'),
+                'color_temperature': light_data.get('color_temperature',
+                                                    self.color_temperature),
+            }
+            fields = encode_command(self._generation + 1, settings, duration)
+            self.brightness = settings['brightness']
+            self.power_state = settings['power_state']
+            self.color_temperature = settings['color_temperature']
+            self._generation += 1
+            self.driver.send(self.index, fields)
+
+    def restore(self, light_data):
+        """
+        Updates DriverLight settings and has the driver display them at
+        once, with no fade.
+
+        Args:
+            light_data: Python dict of light data to represent
+        """
+        self.update_lights(light_data, SHOW_AT_ONCE)
+
+    def wait_for_fade(self, timeout=None):
+        """
+        Blocks until the driver has displayed the latest settings.
+
+        Args:
+            timeout: float of seconds to wait, or None to wait indefinitely
+        Returns:
+            boolean of whether the driver is idle for this zone
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.driver.slots.done(self.index) != self._generation:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(WAIT_INTERVAL)
+        return True
+
+    def close(self):
+        """
+        Turns the lights off, waiting at most a second for the driver.
+
+        Args:
+            None
+        """
+        self.update_lights({'power_state': "OFF",
+                            'brightness': self.brightness})
+        self.wait_for_fade(1)
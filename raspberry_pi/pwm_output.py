@@ -0,0 +1,125 @@
+"""
+PWM output to the pigpio daemon. Tracks the last duty cycle written to each
+pin so that unchanged channels are not written again, and counts the calls
+made to the daemon. A whole fade can also be sent as one pigpio script that
+the daemon plays without a round trip per frame.
+"""
+import time
+
+try:
+    from pigpio import PI_SCRIPT_INITING
+except ImportError:
+    # Value of pigpio.PI_SCRIPT_INITING, to run against a fake daemon
+    PI_SCRIPT_INITING = 0
+
+# Script parameter the fade script stores its current frame index in
+FRAME_PARAM = 9
+
+
+class PWMOutput(object):
+    """
+    PWM output of a set of pins through a pigpio daemon connection.
+    """
+    def __init__(self, pi, pins):
+        super(PWMOutput, self).__init__()
+        self.pi = pi
+        self.pins = tuple(pins)
+        self.last_values = [None] * len(self.pins)
+        # Calls made to the pigpio daemon since the counter was last taken
+        self.daemon_calls = 0
+        self._script_id = None
+        self._frames = ()
+
+    def take_daemon_calls(self):
+        """
+        Gives the count of daemon calls and resets it.
+
+        Returns:
+            int of calls made to the pigpio daemon
+        """
+        calls, self.daemon_calls = self.daemon_calls, 0
+        return calls
+
+    def write(self, values):
+        """
+        Sets the duty cycle of each pin to its value, skipping pins already
+        at that value.
+
+        Args:
+            values: tuple of duty cycles in pin order, between 0 and 255
+        """
+        last_values = self.last_values
+        for index, value in enumerate(values):
+            if value != last_values[index]:
+                self.pi.set_PWM_dutycycle(self.pins[index], value)
+                last_values[index] = value
+                self.daemon_calls += 1
+
+    def _build_fade_script(self, frames, interval):
+        """
+        Builds pigpio script text playing the frames. Each frame only sets
+        changed pins and then stores its index in the FRAME_PARAM parameter.
+
+        Args:
+            frames: list of tuples of duty cycles in pin order
+            interval: float of seconds between frames
+        Returns:
+            string of pigpio script
+        """
+        millis = int(round(interval * 1000))
+        last_values = list(self.last_values)
+        commands = []
+        for index, values in enumerate(frames):
+            if index:
+                commands.append("mils {}".format(millis))
+            for pin_index, value in enumerate(values):
+                if value != last_values[pin_index]:
+                    commands.append("pwm {} {}".format(self.pins[pin_index],
+                                                       value))
+                    last_values[pin_index] = value
+            commands.append("ld p{} {}".format(FRAME_PARAM, index))
+        return " ".join(commands)
+
+    def play_fade(self, frames, interval):
+        """
+        Stores and starts a script playing the frames on the daemon. The fade
+        must be ended with stop_fade, whether or not it has finished. The
+        first frame should be the values currently output.
+
+        Args:
+            frames: list of tuples of duty cycles in pin order
+            interval: float of seconds between frames
+        """
+        script = self._build_fade_script(frames, interval)
+        self._frames = frames
+        self._script_id = self.pi.store_script(script.encode('ascii'))
+        self.daemon_calls += 1
+        # Script can not be run until the daemon has finished compiling it
+        while self.pi.script_status(self._script_id)[0] == \
+                PI_SCRIPT_INITING:
+            self.daemon_calls += 1
+            time.sleep(.001)
+        self.daemon_calls += 1
+        self.pi.run_script(self._script_id, [0] * 10)
+        self.daemon_calls += 1
+
+    def stop_fade(self):
+        """
+        Stops and deletes the fade script if playing.
+
+        Returns:
+            int of index of the last frame played, or None if no fade
+        """
+        if self._script_id is None:
+            return None
+        self.pi.stop_script(self._script_id)
+        status, params = self.pi.script_status(self._script_id)
+        self.pi.delete_script(self._script_id)
+        self.daemon_calls += 3
+        self._script_id = None
+        index = params[FRAME_PARAM]
+        # Pins now hold the values of the frames played
+        for frame in self._frames[:index + 1]:
+            for pin_index, value in enumerate(frame):
+                self.last_values[pin_index] = value
+        return index
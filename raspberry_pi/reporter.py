@@ -0,0 +1,231 @@
+"""
+Publishes the reported state of the lights to the IoT shadow from its own
+thread. Reports made within the publish interval are merged, and only the
+fields changed since they were last sent are published. Fields are
+compared with the values last sent rather than last acknowledged, so a
+report going back to a value while another publish is in flight is not
+taken as unchanged.
+
+Settings made on the device, such as by local control, are also published
+as desired state, so the shadow does not send the old desired state back
+as a delta. While the connection is down reports are held, merged, and
+published once it is back up, after the shadow has been fetched and
+reconciled so the newer of the device's and the shadow's value of each
+desired field wins.
+"""
+import json
+import time
+import threading
+
+from device_logging import get_logger
+
+# Logger information
+logger = get_logger(__name__)
+
+# Stands in for fields never sent
+_MISSING = object()
+
+
+class ReportedStatePublisher(object):
+    """
+    Rate-limited, diff-only publisher of reported state through an
+    AWSIoTMQTTClient. Publishes at most once per interval seconds, and only
+    while online.
+    """
+    def __init__(self, client, topic, interval=1, online=True):
+        super(ReportedStatePublisher, self).__init__()
+        self.client = client
+        self.topic = topic
+        self.interval = interval
+        # Reported fields published, acknowledged or in flight
+        self.sent = {}
+        # Reported fields acknowledged by the shadow
+        self.acknowledged = {}
+        # Counters of reports made and shadow writes published
+        self.stats = {
+            'reports': 0,
+            'publishes': 0,
+            'acknowledged': 0,
+            'unchanged': 0,
+            'requeued': 0,
+        }
+        self.online = online
+        self._condition = threading.Condition()
+        self._pending = None
+        self._pending_desired = None
+        # Desired field to epoch seconds it was last set on the device, to
+        # compare with the shadow's metadata timestamps
+        self._desired_times = {}
+        self._last_publish = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='reported-state-publisher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def report(self, settings, desired=None):
+        """
+        Queues settings to be reported, merged over any not yet published.
+        Returns without waiting for the publish.
+
+        Args:
+            settings: Python dict of reported fields
+            desired: Python dict of fields to also publish as desired
+                state, or None
+        """
+        with self._condition:
+            self.stats['reports'] += 1
+            if self._pending is None:
+                self._pending = dict(settings)
+            else:
+                self._pending.update(settings)
+            if desired:
+                if self._pending_desired is None:
+                    self._pending_desired = dict(desired)
+                else:
+                    self._pending_desired.update(desired)
+                now = time.time()
+                self._desired_times.update((key, now) for key in desired)
+            self._condition.notify()
+
+    def reconcile_desired(self, desired, timestamps=None):
+        """
+        Reconciles desired state of the shadow with desired fields set on
+        the device and not yet published. The newer value of each field
+        wins: device fields older than the shadow's are dropped, and shadow
+        fields older than the device's are left out of the result.
+
+        Args:
+            desired: Python dict of desired fields of the shadow
+            timestamps: Python dict of field to epoch seconds it was set
+                in the shadow, fields missing being taken as newest
+        Returns:
+            Python dict of desired fields of the shadow to apply
+        """
+        timestamps = timestamps or {}
+        with self._condition:
+            if self._pending_desired is None:
+                return desired
+            applied = {}
+            for key, value in desired.items():
+                set_locally = self._desired_times.get(key)
+                if key in self._pending_desired and \
+                        timestamps.get(key) is not None and \
+                        timestamps[key] < set_locally:
+                    continue
+                self._pending_desired.pop(key, None)
+                applied[key] = value
+            if not self._pending_desired:
+                self._pending_desired = None
+            return applied
+
+    def set_online(self, online):
+        """
+        Holds reports while the connection is down, and publishes those
+        held once it is back up.
+
+        Args:
+            online: boolean of whether the connection is up
+        """
+        with self._condition:
+            self.online = online
+            self._condition.notify()
+
+    def close(self, timeout=1):
+        """
+        Publishes any pending report and stops the publisher thread.
+
+        Args:
+            timeout: float of seconds to wait for the thread
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        """
+        Publisher loop. Waits for a pending report, the connection and the
+        end of the publish interval, then publishes it. Runs until closed.
+        Reports still held offline when closed are dropped.
+
+        Args:
+            None
+        """
+        while True:
+            with self._condition:
+                while True:
+                    if self._pending is None or not self.online:
+                        if self._closed:
+                            return
+                        self._condition.wait()
+                        continue
+                    wait = (self._last_publish + self.interval -
+                            time.monotonic())
+                    if wait <= 0 or self._closed:
+                        break
+                    self._condition.wait(wait)
+                report, self._pending = self._pending, None
+                desired, self._pending_desired = self._pending_desired, None
+                self._last_publish = time.monotonic()
+            if not self._publish(report, desired):
+                self._requeue(report, desired)
+
+    def _publish(self, report, desired=None):
+        """
+        Publishes the fields of the report differing from the ones last
+        sent, and the desired fields, if any.
+
+        Args:
+            report: Python dict of reported fields
+            desired: Python dict of desired fields, or None
+        Returns:
+            boolean of whether nothing is left to publish
+        """
+        changed = dict((key, value) for key, value in report.items()
+                       if self.sent.get(key, _MISSING) != value)
+        if not changed and not desired:
+            self.stats['unchanged'] += 1
+            return True
+        state = {'reported': changed}
+        if desired:
+            state['desired'] = desired
+        JSON_payload = json.dumps({'state': state})
+        try:
+            self.client.publishAsync(self.topic, JSON_payload, 1,
+                ackCallback=lambda mid: self._on_acknowledged(changed))
+            self.stats['publishes'] += 1
+        except Exception as e:
+            logger.error(e)
+            return False
+        self.sent.update(changed)
+        return True
+
+    def _requeue(self, report, desired):
+        """
+        Puts back a report that could not be published, under any made
+        since, to be published after the next interval.
+
+        Args:
+            report: Python dict of reported fields
+            desired: Python dict of desired fields, or None
+        """
+        with self._condition:
+            self.stats['requeued'] += 1
+            report = dict(report)
+            report.update(self._pending or {})
+            self._pending = report
+            if desired:
+                desired = dict(desired)
+                desired.update(self._pending_desired or {})
+                self._pending_desired = desired
+
+    def _on_acknowledged(self, changed):
+        """
+        Records published fields as acknowledged.
+
+        Args:
+            changed: Python dict of published fields
+        """
+        self.acknowledged.update(changed)
+        self.stats['acknowledged'] += 1
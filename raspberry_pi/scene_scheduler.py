@@ -0,0 +1,300 @@
+"""
+On-device scene scheduler. Scenes are light settings reached over a
+duration, such as a sunrise over 30 minutes, and schedule entries start a
+scene at a local time of day. Transitions run on the Light's fade engine,
+so the shadow only sees the start and end of a scene instead of every
+brightness level.
+
+The schedule is set through the "schedule" field of the desired state and
+stored in a JSON file so it survives restarts:
+
+    {"scenes": {"sunrise": {"start": {"power_state": "ON", "brightness": 1},
+                            "power_state": "ON", "brightness": 100,
+                            "color_temperature": "DIRECT_SUNLIGHT",
+                            "duration": 1800},
+                "night": {"power_state": "ON", "brightness": 10,
+                          "duration": 600}},
+     "entries": [{"at": "06:30", "scene": "sunrise", "days": [0, 1, 2, 3, 4]},
+                 {"at": "23:00", "scene": "night"}]}
+
+Days are weekday numbers, Monday being 0, and default to every day.
+"""
+import os
+import json
+import time
+import datetime
+import threading
+
+from device_logging import get_logger
+
+# Directory of the stored schedules
+state_dir = os.path.expanduser(os.environ.get("MY_PAINTING_STATE_DIR",
+                                              "~/.my_painting"))
+
+# Longest wait for the next entry, so wall clock changes are picked up
+MAX_WAIT = 60
+
+# Seconds beyond a scene's duration to wait for its fade to finish
+FADE_MARGIN = 5
+
+# Most seconds a schedule change waits to be stored while a scene runs
+SAVE_INTERVAL = 1
+
+# Logger information
+logger = get_logger(__name__)
+
+EMPTY_SCHEDULE = {'scenes': {}, 'entries': []}
+
+
+def merge_schedule(schedule, delta):
+    """
+    Merges a desired state delta into a schedule the way the shadow merges
+    documents. Objects are merged field by field, null removes a field and
+    other values, lists included, replace it.
+
+    Args:
+        schedule: Python dict of schedule
+        delta: Python dict of changed schedule fields
+    Returns:
+        Python dict of merged schedule
+    """
+    merged = dict(schedule)
+    for key, value in delta.items():
+        if value is None:
+            merged.pop(key, None)
+        elif isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_schedule(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def next_occurrence(entry, now):
+    """
+    Gives the next local time a schedule entry is due after now.
+
+    Args:
+        entry: Python dict of schedule entry
+        now: datetime.datetime of local time
+    Returns:
+        datetime.datetime, or None if the entry has no valid day
+    Raises:
+        ValueError, KeyError
+    """
+    hour, minute = [int(part) for part in entry['at'].split(':')]
+    days = entry.get('days', range(7))
+    candidate = now.replace(hour=hour, minute=minute, second=0,
+                            microsecond=0)
+    for _ in range(8):
+        if candidate > now and candidate.weekday() in days:
+            return candidate
+        candidate += datetime.timedelta(days=1)
+    return None
+
+
+class SceneScheduler(object):
+    """
+    Runs the scenes of a schedule on a Light from its own thread, reporting
+    the state at the start and end of each scene through a reporter, an
+    object with a report method taking reported and desired fields, such
+    as a ReportedStatePublisher or the zone. Schedule changes are stored and reported from the same thread.
+    """
+    def __init__(self, light, reporter, schedule_path=None, lock=None):
+        super(SceneScheduler, self).__init__()
+        self.light = light
+        self.reporter = reporter
+        self.schedule_path = schedule_path
+        # Held while reading, merging and updating the Light's settings
+        self.lock = threading.Lock() if lock is None else lock
+        self.schedule = self._load()
+        self.stats = {
+            'scenes': 0,
+            'preempted': 0,
+        }
+        self._condition = threading.Condition()
+        self._changed = False
+        self._unsaved = False
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='scene-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _load(self):
+        """
+        Reads the stored schedule.
+
+        Returns:
+            Python dict of schedule
+        """
+        if not self.schedule_path or not os.path.exists(self.schedule_path):
+            return dict(EMPTY_SCHEDULE)
+        try:
+            with open(self.schedule_path) as schedule_file:
+                return json.load(schedule_file)
+        except ValueError as e:
+            logger.error('Unreadable schedule %s: %s', self.schedule_path, e)
+            return dict(EMPTY_SCHEDULE)
+
+    def _store(self):
+        """
+        Writes the schedule to a temporary file and renames it over the
+        stored one, so a power cut never leaves a partial schedule.
+        """
+        if not self.schedule_path:
+            return
+        directory = os.path.dirname(self.schedule_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        temporary_path = self.schedule_path + '.tmp'
+        with open(temporary_path, 'w') as schedule_file:
+            json.dump(self.schedule, schedule_file)
+        os.replace(temporary_path, self.schedule_path)
+
+    def update_schedule(self, delta):
+        """
+        Merges a desired state delta of the schedule and wakes the
+        scheduler thread, which stores the schedule and reports it so the
+        delta is cleared. Returns without waiting for either, as it is
+        called from the MQTT client thread.
+
+        Args:
+            delta: Python dict of changed schedule fields
+        """
+        with self._condition:
+            self.schedule = merge_schedule(self.schedule, delta)
+            self._changed = True
+            self._unsaved = True
+            self._condition.notify()
+
+    def _save(self):
+        """
+        Stores and reports the schedule if it changed since last saved.
+
+        Args:
+            None
+        """
+        with self._condition:
+            if not self._unsaved:
+                return
+            self._unsaved = False
+            schedule = self.schedule
+        try:
+            self._store()
+        except (IOError, OSError) as e:
+            logger.error(e)
+        self.reporter.report({'schedule': schedule})
+
+    def close(self, timeout=1):
+        """
+        Stops the scheduler thread. A scene in progress is left to the
+        Light.
+
+        Args:
+            timeout: float of seconds to wait for the thread
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _next_entry(self, now):
+        """
+        Gives the schedule entry due next.
+
+        Args:
+            now: datetime.datetime of local time
+        Returns:
+            tuple of due datetime.datetime and entry, or None
+        """
+        upcoming = []
+        for entry in self.schedule.get('entries', []):
+            try:
+                due = next_occurrence(entry, now)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.error('Invalid schedule entry %s: %s', entry, e)
+                continue
+            if due is not None:
+                upcoming.append((due, entry))
+        if not upcoming:
+            return None
+        return min(upcoming, key=lambda item: item[0])
+
+    def _run(self):
+        """
+        Scheduler loop. Sleeps until the next entry is due, waking early
+        when the schedule changes to save it, then runs its scene. Runs
+        until closed.
+
+        Args:
+            None
+        """
+        upcoming = None
+        while True:
+            self._save()
+            with self._condition:
+                if self._unsaved:
+                    continue
+                if self._closed:
+                    return
+                now = datetime.datetime.now()
+                if upcoming is None or self._changed:
+                    self._changed = False
+                    upcoming = self._next_entry(now)
+                if upcoming is None:
+                    self._condition.wait(MAX_WAIT)
+                    continue
+                wait = (upcoming[0] - now).total_seconds()
+                if wait > 0:
+                    self._condition.wait(min(wait, MAX_WAIT))
+                    continue
+            self._run_scene(upcoming[1]['scene'])
+            upcoming = None
+
+    def _run_scene(self, scene_name):
+        """
+        Moves the Light to a scene's start settings, then to its settings
+        over its duration. Reports the state the scene starts from once,
+        along with its settings as desired state so the shadow does not
+        send the old desired state back as a delta, and reports the state
+        once when it ends. A desired state update preempts the scene.
+
+        Args:
+            scene_name: string of scene name
+        """
+        scene = self.schedule.get('scenes', {}).get(scene_name)
+        if scene is None:
+            logger.error('Unknown scene %s', scene_name)
+            return
+        logger.info('Starting scene %s', scene_name)
+        self.stats['scenes'] += 1
+        duration = float(scene.get('duration', 0)) or None
+        if scene.get('start'):
+            with self.lock:
+                start = self.light.current_settings()
+                start.update(scene['start'])
+                self.light.update_lights(start)
+            self.light.wait_for_fade(FADE_MARGIN)
+        desired = dict((key, value) for key, value in scene.items()
+                       if key not in ('start', 'duration'))
+        with self.lock:
+            report = self.light.current_settings()
+            report['scene'] = scene_name
+            settings = self.light.current_settings()
+            settings.update(desired)
+            self.light.update_lights(settings, duration)
+        self.reporter.report(report, desired)
+
+        # Schedule changes made during the scene are saved as it runs
+        deadline = time.monotonic() + (duration or 0) + FADE_MARGIN
+        while not self.light.wait_for_fade(
+                max(0, min(SAVE_INTERVAL, deadline - time.monotonic()))):
+            self._save()
+            if time.monotonic() >= deadline:
+                logger.error('Scene %s did not finish', scene_name)
+                break
+        end = self.light.current_settings()
+        if any(end[key] != settings[key] for key in end):
+            self.stats['preempted'] += 1
+            logger.info('Scene %s preempted', scene_name)
+        end['scene'] = None
+        self.reporter.report(end)
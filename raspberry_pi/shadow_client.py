@@ -1,32 +1,64 @@
 """
-Connection between the Raspberry Pi and the AWS IoT Shadow endpoint.
+Connection between the Raspberry Pi and the AWS IoT Shadow endpoint. One
+MQTT connection serves every lighting zone of the device.
+
+At start up each zone is lit with its stored settings before connecting,
+then reports them and reconciles with the shadow's desired state, fetched
+once through the shadow get topic.
 """
 import os
-import logging
 import time
 import json
+import signal
 import argparse
+import threading
 
-from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+try:
+    from AWSIoTPythonSDK.MQTTLib import AWSIoTMQTTClient
+except ImportError:
+    AWSIoTMQTTClient = None
 
-from lights import Light
+from lights import Light, connect_pi
+from zone import LightZone, load_zone_config
+from lan_control import LanControlServer, lan_port
+from pwm_driver import PWMDriver, driver_mode
+from device_logging import get_logger
 
-# Shadow JSON schema:
+# Shadow JSON schema, of the classic shadow or of the named shadow of
+# each zone:
 #
 # Name: my_painting
 # {
 #	"state": {
 #		"desired":{
 #			"brightness":<int>,
-#           "power_state":<str>
+#           "power_state":<str>,
+#           "color_temperature":<int Kelvin or str light source>,
+#           "schedule":<dict of scenes and entries, see scene_scheduler>
 #		},
 #       "reported":{
 #           "brightness":<int>,
-#           "power_state":<str>
+#           "power_state":<str>,
+#           "color_temperature":<int Kelvin or str light source>,
+#           "schedule":<dict of scenes and entries>,
+#           "scene":<str name of scene running, or null>
 #		}
 #	 }
 # }
 
+# Seconds to let bursts of desired state updates settle before applying
+debounce = float(os.environ.get("MY_PAINTING_DEBOUNCE", 0))
+
+# Minimum seconds between reported state publishes
+report_interval = float(os.environ.get("MY_PAINTING_REPORT_INTERVAL", 1))
+
+# Most seconds between attempts of the first connection
+MAX_CONNECT_BACKOFF = 32
+
+# Most seconds reports are held for the shadow to be fetched after
+# connecting, in case the get is never answered
+GET_TIMEOUT = 10
+
 # Set variables from env
 host = os.environ.get("AWS_IOT_MQTT_HOST")
 port = os.environ.get("AWS_IOT_MQTT_PORT")
@@ -37,40 +69,91 @@ publicKeyPath = os.environ.get("AWS_IOT_PUBLIC_KEY_FILENAME")
 thingName = os.environ.get("AWS_IOT_MY_THING_NAME")
 clientId = os.environ.get("AWS_IOT_MQTT_CLIENT_ID")
 
-# topic strings
-update_topic = "$aws/things/{0}/shadow/update".format(thingName)
-update_docs_topic = "$aws/things/{0}/shadow/update/documents".format(thingName)
-
 # Logger information
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
-streamHandler = logging.StreamHandler()
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-streamHandler.setFormatter(formatter)
-logger.addHandler(streamHandler)
+logger = get_logger(__name__)
 
 
 class MyPaintingMQTTClient():
     """
     Client to maintain a connection between the Raspberry Pi and the IoT
     Shadow. Updates LED lights through a Light object.
+
+    Hooks on_connect, on_disconnect and on_reconnect can be set to functions
+    taking the client. They are called from the MQTT client threads.
+
+    Zones are read with load_zone_config and share this connection and one
+    pigpio daemon connection. The first zone's Light is also the light
+    attribute. If MY_PAINTING_LAN_PORT is set, the zones can also be
+    controlled locally through a LanControlServer. If MY_PAINTING_DRIVER
+    is "process", fades are rendered by a PWMDriver process owning the
+    pigpio daemon connection.
+
+    The MQTT client and pigpio daemon connection, or a PWMDriver, can be
+    passed in, such as with the stand-ins of fake_backends to run off the
+    Pi.
     """
-    def __init__(self):
-        self.light = Light()
+    def __init__(self, on_connect=None, on_disconnect=None,
+                 on_reconnect=None, debounce=debounce, mqtt_client=None,
+                 pi=None, driver=None):
+        self.on_connect = on_connect
+        self.on_disconnect = on_disconnect
+        self.on_reconnect = on_reconnect
+
+        # Set to stop run_app
+        self._stop_event = threading.Event()
+        self._has_connected = False
+        self._online = False
+        # Zones holding reports until their shadow has been fetched
+        self._fetching = set()
+        self._fetching_lock = threading.Lock()
 
-        self._get_shadow_client()
+        self._get_shadow_client(mqtt_client)
 
-    def _get_shadow_client(self):
+        zone_configs = load_zone_config()
+        if driver is None and driver_mode == 'process':
+            driver = PWMDriver([zone['pins'] for zone in zone_configs])
+        self.driver = driver
+        if driver is None:
+            self.pi = connect_pi() if pi is None else pi
+            lights = [Light(zone['pins'], self.pi) for zone in zone_configs]
+        else:
+            self.pi = None
+            lights = driver.lights
+        self.zones = [LightZone(zone['name'], light, self.shadowClient,
+                                thingName, debounce, report_interval)
+                      for zone, light in zip(zone_configs, lights)]
+        # Reports are held until connected and reconciled with the shadow
+        for zone in self.zones:
+            zone.reporter.set_online(False)
+        self.light = self.zones[0].light
+        # Update delta and get topics to zone receiving them
+        self._zones_by_topic = dict((zone.update_delta_topic, zone)
+                                    for zone in self.zones)
+        self._zones_by_get_topic = dict(
+            [(zone.get_accepted_topic, zone) for zone in self.zones] +
+            [(zone.get_rejected_topic, zone) for zone in self.zones])
+        self.lan_server = LanControlServer(self.zones) if lan_port else None
+
+    def _get_shadow_client(self, mqtt_client=None):
         """
         Creates, configures, and sets AWSIoTMQTTClient to communicate
         with AWS IoT Thing.
 
         Args:
-            None
+            mqtt_client: client to configure instead of a new
+                AWSIoTMQTTClient
         Returns:
             AWSIoTMQTTClient
+        Raises:
+            ImportError if AWSIoTPythonSDK is not installed and no client
+            is given
         """
-        self.shadowClient = AWSIoTMQTTClient(clientId)
+        if mqtt_client is None:
+            if AWSIoTMQTTClient is None:
+                raise ImportError('AWSIoTPythonSDK is not installed, pass an '
+                                  'mqtt_client to run without it')
+            mqtt_client = AWSIoTMQTTClient(clientId)
+        self.shadowClient = mqtt_client
 
         self.shadowClient.configureEndpoint(host, port)
         self.shadowClient.configureCredentials(rootCAPath,
@@ -79,16 +162,52 @@ class MyPaintingMQTTClient():
         self.shadowClient.configureAutoReconnectBackoffTime(1, 32, 20)
         self.shadowClient.configureConnectDisconnectTimeout(10)
         self.shadowClient.configureMQTTOperationTimeout(1)
-        
+        self.shadowClient.onOnline = self._on_online
+        self.shadowClient.onOffline = self._on_offline
+
         return self.shadowClient
 
+    def _on_online(self):
+        """
+        Called by the MQTT client when the connection is up. Calls the
+        on_reconnect hook if connected before, otherwise on_connect. On a
+        reconnection, fetches each zone's shadow to pick up changes made
+        during the outage, and publishes the reports held while offline
+        once reconciled with it.
+
+        Args:
+            None
+        """
+        hook = self.on_reconnect if self._has_connected else self.on_connect
+        logger.info('Reconnected' if self._has_connected else 'Connected')
+        self._online = True
+        if self._has_connected:
+            for zone in self.zones:
+                self._fetch_shadow(zone, self.shadowClient.publishAsync)
+        self._has_connected = True
+        if hook is not None:
+            hook(self)
+
+    def _on_offline(self):
+        """
+        Called by the MQTT client when the connection is lost or closed.
+        Holds reports until reconnected and calls the on_disconnect hook.
+
+        Args:
+            None
+        """
+        logger.info('Disconnected')
+        self._online = False
+        for zone in self.zones:
+            zone.reporter.set_online(False)
+        if self.on_disconnect is not None:
+            self.on_disconnect(self)
+
     def _subscribe_update_callback(self, client, userdata, message):
         """
-        Callback after subscribe to update documents topic. Retrieves the
-        payload from the MQTTMessage and checks if Light object needs to
-        be updated. If Lights object needs to be updated, updates the lights
-        and sends an update to the IoT shadow. Will except ValueError and
-        exceptions and log if payload is missing.
+        Callback after subscribe to update delta topics. Retrieves the
+        payload from the MQTTMessage and hands it to the zone of the topic.
+        Will except ValueError and exceptions and log if payload is missing.
 
         Client and Userdata may be deprecated in the future.
 
@@ -97,49 +216,198 @@ class MyPaintingMQTTClient():
             userdata: string
             message: MQTTMessage instance
         """
-        logger.info('Message recieved from {} topic'.format(message.topic))
+        logger.info('Message recieved from %s topic', message.topic)
         payload = message.payload
         try:
-            payload_dict = json.loads(payload)
-            light_data = payload_dict['current']['state']['desired']
-            if self.light.needs_updating(light_data):
-                self.light.update_lights(light_data)
-                reported_payload = {
-                                       'state': {
-                                           'reported': self.light.current_settings()
-                                       }
-                                   }
-                JSON_payload = json.dumps(reported_payload)
-                self.shadowClient.publish(update_topic, JSON_payload, 0)
+            self._zones_by_topic[message.topic].handle_delta(payload)
         except ValueError:
             logger.error('Value error')
             logger.info(payload)
         except Exception as e:
-            logger.error(e.message)
+            logger.error(e)
+
+    def _subscribe_get_callback(self, client, userdata, message):
+        """
+        Callback after subscribe to get accepted and rejected topics.
+        Reconciles the zone with the desired state of its shadow. If the
+        shadow has no desired state yet, as on first start, it is set to the
+        zone's current settings. Then releases the zone's held reports.
+
+        Args:
+            client: string
+            userdata: string
+            message: MQTTMessage instance
+        """
+        logger.info('Message recieved from %s topic', message.topic)
+        zone = self._zones_by_get_topic[message.topic]
+        try:
+            if message.topic == zone.get_accepted_topic and \
+                    zone.handle_document(message.payload):
+                return
+            if message.topic == zone.get_rejected_topic:
+                logger.info('Shadow not fetched: %s', message.payload)
+            JSON_payload = json.dumps({
+                'state': {'desired': zone.light.current_settings()}})
+            self.shadowClient.publishAsync(zone.update_topic, JSON_payload,
+                                           1)
+        except ValueError:
+            logger.error('Value error')
+            logger.info(message.payload)
+        except Exception as e:
+            logger.error(e)
+        finally:
+            self._release_reports(zone)
+
+    def _fetch_shadow(self, zone, publish):
+        """
+        Holds a zone's reports and requests its shadow document, answered
+        on the get topics. The reports are released when it is handled, or
+        after GET_TIMEOUT seconds.
+
+        Args:
+            zone: LightZone to fetch the shadow of
+            publish: function publishing a payload to a topic at a QoS
+        """
+        with self._fetching_lock:
+            self._fetching.add(zone)
+        zone.reporter.set_online(False)
+        timer = threading.Timer(GET_TIMEOUT, self._release_reports, (zone,))
+        timer.daemon = True
+        timer.start()
+        try:
+            publish(zone.get_topic, '', 0)
+        except Exception as e:
+            logger.error(e)
+
+    def _release_reports(self, zone):
+        """
+        Publishes the reports a zone held while its shadow was fetched, if
+        still online.
+
+        Args:
+            zone: LightZone whose shadow was fetched
+        """
+        with self._fetching_lock:
+            if zone not in self._fetching:
+                return
+            self._fetching.discard(zone)
+        zone.reporter.set_online(self._online)
+
+    def _connect(self):
+        """
+        Connects to the IoT Shadow, retrying with backoff until connected
+        or stopped, so local control keeps working while the internet is
+        down at start up. The MQTT client reconnects by itself after the
+        first connection.
+
+        Args:
+            None
+        Returns:
+            boolean of whether connected
+        """
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                self.shadowClient.connect()
+                return True
+            except Exception as e:
+                logger.error('Connection failed, retrying in %ss: %s',
+                             backoff, e)
+            self._stop_event.wait(backoff)
+            backoff = min(backoff * 2, MAX_CONNECT_BACKOFF)
+        return False
 
     def run_app(self, set_desired_state=False):
         """
-        Connects to IoT Shadow through MQTT connection. Updates state of
-        shadow with current light settings to update topic. Subscribes to
-        update/documents topic of thing shadow from update/documents topic
-        and handles callback with _subscribe_update_callback.
+        Lights each zone with its stored settings, starts local control if
+        enabled and connects to IoT Shadow through MQTT connection, so the
+        lights never wait on the network. Subscribes to update/delta topic
+        of each zone's shadow and handles callback with
+        _subscribe_update_callback. Reports each zone's current settings,
+        then fetches its shadow once to reconcile with the desired state
+        set while offline. Settings made locally while offline are
+        published afterwards, where newer than the shadow's. Blocks until stop is called or SIGTERM or SIGINT
+        is received, then shuts down. Must be called from the main thread
+        to handle signals.
 
         Args:
             set_desired: boolean to send update to desired state
         """
-        self.shadowClient.connect()
-        start_payload = {
-                            'state': {
-                                'reported': self.light.current_settings(),
-                                'desired': self.light.current_settings()
+        signal.signal(signal.SIGTERM, self._handle_signal)
+        signal.signal(signal.SIGINT, self._handle_signal)
+        for zone in self.zones:
+            zone.restore()
+        if self.lan_server is not None:
+            self.lan_server.start()
+        if not self._connect():
+            self.shutdown()
+            return
+        for zone in self.zones:
+            self.shadowClient.subscribe(zone.update_delta_topic, 1,
+                                        self._subscribe_update_callback)
+            self.shadowClient.subscribe(zone.get_accepted_topic, 1,
+                                        self._subscribe_get_callback)
+            self.shadowClient.subscribe(zone.get_rejected_topic, 1,
+                                        self._subscribe_get_callback)
+            start_payload = {
+                                'state': {
+                                    'reported': zone.light.current_settings()
+                                }
                             }
-                        }
-        JSON_payload = json.dumps(start_payload)
-        self.shadowClient.publish(update_topic, JSON_payload, 0)
-        self.shadowClient.subscribe(update_docs_topic, 1,
-                                    self._subscribe_update_callback)
-        while True:
-            pass
+            if set_desired_state:
+                start_payload['state']['desired'] = \
+                    zone.light.current_settings()
+            JSON_payload = json.dumps(start_payload)
+            self.shadowClient.publish(zone.update_topic, JSON_payload, 0)
+            self._fetch_shadow(zone, self.shadowClient.publish)
+        self._stop_event.wait()
+        self.shutdown()
+
+    def stop(self):
+        """
+        Stops run_app. Safe to call from any thread.
+
+        Args:
+            None
+        """
+        self._stop_event.set()
+
+    def _handle_signal(self, signum, frame):
+        """
+        Signal handler stopping run_app.
+
+        Args:
+            signum: int of signal number
+            frame: current stack frame
+        """
+        logger.info('Received signal %s', signum)
+        self.stop()
+
+    def shutdown(self):
+        """
+        Stops local control and turns the lights of every zone off, then
+        unsubscribes and disconnects from the IoT Shadow and stops the PWM
+        driver or pigpio daemon connection.
+
+        Args:
+            None
+        """
+        if self.lan_server is not None:
+            self.lan_server.close()
+        for zone in self.zones:
+            zone.close()
+        try:
+            for zone in self.zones:
+                self.shadowClient.unsubscribe(zone.update_delta_topic)
+                self.shadowClient.unsubscribe(zone.get_accepted_topic)
+                self.shadowClient.unsubscribe(zone.get_rejected_topic)
+            self.shadowClient.disconnect()
+        except Exception as e:
+            logger.error(e)
+        if self.driver is not None:
+            self.driver.close()
+        else:
+            self.pi.stop()
 
 
 def main():
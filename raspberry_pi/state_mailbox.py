@@ -0,0 +1,73 @@
+"""
+Latest-wins mailbox between the MQTT callback and the thread applying
+desired state to the lights. Updates put while one is pending are merged
+into it, so the taker only ever sees the newest desired state.
+"""
+import time
+import threading
+
+
+class LatestMailbox(object):
+    """
+    Mailbox holding at most one pending update, a Python dict that newer
+    updates are merged into. An optional debounce window in seconds lets
+    bursts of updates settle before one is taken.
+    """
+    def __init__(self, debounce=0):
+        super(LatestMailbox, self).__init__()
+        self.debounce = debounce
+        self._condition = threading.Condition()
+        self._pending = None
+        self._last_put = 0
+        self._closed = False
+
+    def put(self, update):
+        """
+        Merges the update into the pending update, or makes it pending.
+
+        Args:
+            update: Python dict of update
+        Returns:
+            boolean of whether the update was coalesced into a pending one
+        """
+        with self._condition:
+            coalesced = self._pending is not None
+            if coalesced:
+                self._pending.update(update)
+            else:
+                self._pending = dict(update)
+            self._last_put = time.monotonic()
+            self._condition.notify()
+        return coalesced
+
+    def take(self):
+        """
+        Blocks until an update is pending and no other update has been put
+        for the debounce window, then removes and gives it.
+
+        Returns:
+            Python dict of update, or None if the mailbox is closed
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                if self._pending is not None:
+                    wait = self._last_put + self.debounce - time.monotonic()
+                    if wait <= 0:
+                        update, self._pending = self._pending, None
+                        return update
+                    self._condition.wait(wait)
+                else:
+                    self._condition.wait()
+
+    def close(self):
+        """
+        Closes the mailbox, waking a blocked take.
+
+        Args:
+            None
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
@@ -0,0 +1,144 @@
+"""
+Last known light settings of a zone, kept in a small JSON file so the
+lights come back as the user left them after a restart or power cut,
+before the MQTT connection is up.
+
+Saves are merged and written from their own thread at most once per
+MY_PAINTING_STATE_SAVE_INTERVAL seconds, to spare the SD card. Each write
+goes to a temporary file that is synced and renamed over the stored one,
+so a power cut never leaves a partial file.
+"""
+import os
+import json
+import time
+import threading
+
+from device_logging import get_logger
+
+# Minimum seconds between writes of the state file
+save_interval = float(os.environ.get("MY_PAINTING_STATE_SAVE_INTERVAL", 5))
+
+# Settings of the Light that are stored
+FIELDS = ('power_state', 'brightness', 'color_temperature')
+
+# Logger information
+logger = get_logger(__name__)
+
+
+class LightStateStore(object):
+    """
+    Rate-limited, atomic store of light settings in the JSON file at path.
+    """
+    def __init__(self, path, interval=save_interval):
+        super(LightStateStore, self).__init__()
+        self.path = path
+        self.interval = interval
+        # Counters of saves asked for and files written
+        self.stats = {
+            'saves': 0,
+            'writes': 0,
+            'failures': 0,
+        }
+        self._condition = threading.Condition()
+        self._state = self.load() or {}
+        self._dirty = False
+        self._last_write = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run,
+                                        name='light-state-store')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def load(self):
+        """
+        Reads the stored settings.
+
+        Returns:
+            Python dict of light settings, or None if none are stored
+        """
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as state_file:
+                state = json.load(state_file)
+        except (IOError, OSError, ValueError) as e:
+            logger.error('Unreadable state %s: %s', self.path, e)
+            return None
+        return dict((key, value) for key, value in state.items()
+                    if key in FIELDS) or None
+
+    def save(self, settings):
+        """
+        Merges the light fields of settings into the stored state, to be
+        written within the save interval. Returns without waiting for the
+        write.
+
+        Args:
+            settings: Python dict of light settings, other fields ignored
+        """
+        with self._condition:
+            self.stats['saves'] += 1
+            for key in FIELDS:
+                if key in settings and self._state.get(key) != settings[key]:
+                    self._state[key] = settings[key]
+                    self._dirty = True
+            self._condition.notify()
+
+    def close(self, timeout=1):
+        """
+        Writes any unwritten state and stops the writer thread.
+
+        Args:
+            timeout: float of seconds to wait for the thread
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        """
+        Writer loop. Waits for unwritten state and the end of the save
+        interval, then writes it. Runs until closed.
+
+        Args:
+            None
+        """
+        while True:
+            with self._condition:
+                while True:
+                    if not self._dirty:
+                        if self._closed:
+                            return
+                        self._condition.wait()
+                        continue
+                    wait = self._last_write + self.interval - time.monotonic()
+                    if wait <= 0 or self._closed:
+                        break
+                    self._condition.wait(wait)
+                state, self._dirty = dict(self._state), False
+                self._last_write = time.monotonic()
+            self._write(state)
+
+    def _write(self, state):
+        """
+        Writes state to a temporary file, syncs it and renames it over the
+        stored one.
+
+        Args:
+            state: Python dict of light settings
+        """
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'w') as state_file:
+                json.dump(state, state_file)
+                state_file.flush()
+                os.fsync(state_file.fileno())
+            os.replace(temporary_path, self.path)
+            self.stats['writes'] += 1
+        except (IOError, OSError) as e:
+            self.stats['failures'] += 1
+            logger.error(e)
@@ -0,0 +1,294 @@
+"""
+Lighting zones. Each zone is a Light on its own pins with its own shadow,
+either the classic shadow of the thing or a named shadow, and its own
+mailbox, updater thread, reporter, scene scheduler and stored state. Zones
+share one MQTT connection and one pigpio daemon connection.
+
+Zones are read from the JSON file at MY_PAINTING_ZONES_FILE:
+
+    {"zones": [{"name": "left", "pins": [4, 17, 22]},
+               {"name": "right", "pins": [5, 6, 13]}]}
+
+Without it, one zone on PINS uses the classic shadow.
+"""
+import os
+import json
+import threading
+
+from light_values import RGB
+from lights import PINS
+from state_mailbox import LatestMailbox
+from reporter import ReportedStatePublisher
+from state_store import LightStateStore
+from scene_scheduler import SceneScheduler, state_dir
+from device_logging import get_logger
+
+zones_file = os.environ.get("MY_PAINTING_ZONES_FILE")
+
+# Logger information
+logger = get_logger(__name__)
+
+
+def shadow_topic(thing_name, shadow_name, suffix):
+    """
+    Gives a shadow topic of the classic shadow, or of a named shadow.
+
+    Args:
+        thing_name: string of thing name
+        shadow_name: string of shadow name, or None for the classic shadow
+        suffix: string of topic after shadow, such as "update/delta"
+    Returns:
+        string of topic
+    """
+    if shadow_name is None:
+        return "$aws/things/{0}/shadow/{1}".format(thing_name, suffix)
+    return "$aws/things/{0}/shadow/name/{1}/{2}".format(thing_name,
+                                                        shadow_name, suffix)
+
+def load_zone_config():
+    """
+    Reads the zones file, or gives the single default zone.
+
+    Returns:
+        list of Python dicts of zone name and RGB tuple of pins
+    """
+    if not zones_file:
+        return [{'name': None, 'pins': PINS}]
+    with open(zones_file) as config_file:
+        zones = json.load(config_file)['zones']
+    return [{'name': zone.get('name'), 'pins': RGB(*zone['pins'])}
+            for zone in zones]
+
+
+class LightZone(object):
+    """
+    A Light and the shadow it follows. Desired state deltas of the shadow
+    are put in a latest-wins mailbox and applied by an updater thread, so a
+    burst of updates moves the lights straight to the newest one. Changes
+    to the schedule field go to the zone's scene scheduler. Settings
+    applied are reported to the shadow and kept in the zone's state store.
+    """
+    def __init__(self, name, light, client, thing_name, debounce=0,
+                 report_interval=1):
+        super(LightZone, self).__init__()
+        self.name = name
+        self.light = light
+        self.update_topic = shadow_topic(thing_name, name, "update")
+        self.update_delta_topic = shadow_topic(thing_name, name,
+                                               "update/delta")
+        self.get_topic = shadow_topic(thing_name, name, "get")
+        self.get_accepted_topic = shadow_topic(thing_name, name,
+                                               "get/accepted")
+        self.get_rejected_topic = shadow_topic(thing_name, name,
+                                               "get/rejected")
+
+        # Latest shadow version acted on, older deltas are dropped
+        self.shadow_version = 0
+
+        # Counters of desired state messages
+        self.stats = {
+            'received': 0,
+            'coalesced': 0,
+            'applied': 0,
+            'local': 0,
+        }
+        # Held while reading, merging and updating the Light's settings, as
+        # the updater, local control and scheduler threads all update it
+        self._lock = threading.Lock()
+        self.mailbox = LatestMailbox(debounce)
+        self.reporter = ReportedStatePublisher(client, self.update_topic,
+                                               report_interval)
+        self.state_store = LightStateStore(
+            os.path.join(state_dir,
+                         'state-{}.json'.format(name or 'default')))
+        self.scheduler = SceneScheduler(
+            light, self,
+            os.path.join(state_dir,
+                         'schedule-{}.json'.format(name or 'default')),
+            self._lock)
+        self._updater_thread = threading.Thread(
+            target=self._run_updater,
+            name='light-updater-{}'.format(name or 'default'))
+        self._updater_thread.daemon = True
+        self._updater_thread.start()
+
+    def restore(self):
+        """
+        Shows the settings stored before the last shutdown at once, with no
+        fade, so the painting is lit as the user left it without waiting
+        for the shadow.
+
+        Returns:
+            boolean of whether settings were stored
+        """
+        stored = self.state_store.load()
+        if stored is None:
+            return False
+        logger.info('Restoring %s to %s', self.name or 'default', stored)
+        with self._lock:
+            light_data = self.light.current_settings()
+            light_data.update(stored)
+            self.light.restore(light_data)
+        return True
+
+    def handle_delta(self, payload):
+        """
+        Handles a payload of the update delta topic. Drops it if its shadow
+        version is not newer than the last one acted on. The delta only
+        holds desired values differing from reported ones, so it is put in
+        the mailbox to be merged over current settings by the updater
+        thread. A schedule change is merged into the scheduler's schedule
+        here, as merging in the mailbox would drop partial changes.
+
+        Args:
+            payload: JSON string of delta document
+        Raises:
+            ValueError, KeyError
+        """
+        payload_dict = json.loads(payload)
+        self._accept(payload_dict['version'], payload_dict['state'],
+                     payload_dict.get('metadata'))
+
+    def handle_document(self, payload):
+        """
+        Handles a payload of the get accepted topic, the whole shadow
+        document, reconciling the Light with its desired state the same way
+        as a delta. Fields set on the device while offline after they were
+        set in the shadow are kept, and published once reconnected.
+
+        Args:
+            payload: JSON string of shadow document
+        Returns:
+            boolean of whether the shadow has a desired state
+        Raises:
+            ValueError, KeyError
+        """
+        payload_dict = json.loads(payload)
+        desired = payload_dict.get('state', {}).get('desired')
+        if not desired:
+            return False
+        self._accept(payload_dict['version'], desired,
+                     payload_dict.get('metadata', {}).get('desired'))
+        return True
+
+    def _accept(self, version, desired, metadata=None):
+        """
+        Acts on desired state of a shadow version newer than the last one
+        acted on, leaving out fields set on the device since.
+
+        Args:
+            version: int of shadow version
+            desired: Python dict of desired state
+            metadata: Python dict of shadow metadata of the desired state,
+                or None
+        """
+        if version <= self.shadow_version:
+            logger.info('Dropping stale version %s', version)
+            return
+        self.shadow_version = version
+        self.stats['received'] += 1
+        timestamps = dict((key, value.get('timestamp'))
+                          for key, value in (metadata or {}).items()
+                          if isinstance(value, dict))
+        desired = self.reporter.reconcile_desired(desired, timestamps)
+        schedule = desired.pop('schedule', None)
+        if schedule is not None:
+            self.scheduler.update_schedule(schedule)
+        if desired and self.mailbox.put(desired):
+            self.stats['coalesced'] += 1
+
+    def report(self, settings, desired=None):
+        """
+        Reports settings to the shadow through the reporter and keeps the
+        light settings among them in the state store.
+
+        Args:
+            settings: Python dict of reported fields
+            desired: Python dict of fields to also publish as desired
+                state, or None
+        """
+        self.reporter.report(settings, desired)
+        self.state_store.save(settings)
+
+    def apply_local(self, desired):
+        """
+        Applies desired state from a local controller straight to the
+        Light, skipping the shadow round trip. The fields set reach the
+        shadow through the reporter as both desired and reported state, so
+        the shadow's old desired state is not sent back as a delta. They
+        are held while offline and published once reconnected.
+
+        Args:
+            desired: Python dict of desired light settings
+        Returns:
+            Python dict of current settings of the Light
+        """
+        self.stats['local'] += 1
+        self._apply(desired, local=True)
+        return self.light.current_settings()
+
+    def _apply(self, desired, local=False):
+        """
+        Checks if Light object needs to be updated with desired state. If
+        Lights object needs to be updated, updates the lights and reports
+        the new settings to the IoT shadow through the reporter. Local
+        desired state is published as desired state too, even if the
+        lights already show it. Updates from different threads are applied
+        one at a time, so none loses the fields of another.
+
+        Args:
+            desired: Python dict of desired light settings
+            local: boolean of whether desired state was set on the device
+        """
+        with self._lock:
+            light_data = self.light.current_settings()
+            light_data.update(desired)
+            if self.light.needs_updating(light_data):
+                self.stats['applied'] += 1
+                self.light.update_lights(light_data)
+            elif not local:
+                return
+            self.report(self.light.current_settings(),
+                        desired if local else None)
+
+    def _run_updater(self):
+        """
+        Updater loop. Takes the newest desired state from the mailbox and
+        applies it. Runs until the mailbox is closed.
+
+        Args:
+            None
+        """
+        while True:
+            desired = self.mailbox.take()
+            if desired is None:
+                return
+            try:
+                self._apply(desired)
+            except Exception as e:
+                logger.error(e)
+
+    def close(self):
+        """
+        Stops the scheduler, the updater thread, the reporter and the state
+        store, logs the zone's counters and turns the lights off. The
+        lights going off at shutdown are not stored.
+
+        Args:
+            None
+        """
+        self.scheduler.close()
+        self.mailbox.close()
+        self.reporter.close()
+        self.state_store.close()
+        zone_name = self.name or 'default'
+        logger.info('%s desired state messages: %s', zone_name, self.stats)
+        logger.info('%s reported state: %s', zone_name, self.reporter.stats)
+        logger.info('%s scenes: %s', zone_name, self.scheduler.stats)
+        logger.info('%s stored state: %s', zone_name,
+                    self.state_store.stats)
+        if self.stats['applied']:
+            logger.info('%s shadow writes per applied change: %.2f', zone_name,
+                        float(self.reporter.stats['publishes']) /
+                        self.stats['applied'])
+        self.light.close()
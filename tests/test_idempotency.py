@@ -0,0 +1,58 @@
+"""
+Tests of the local response cache of idempotency.
+"""
+import os
+import sys
+import collections
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo, "lambda_function"))
+
+import idempotency
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(
+            idempotency, CACHE_SIZE=2, STORE="none",
+            _responses=collections.OrderedDict(), _store=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_duplicate_gets_response(self):
+        idempotency.remember('a', {'response': 'a'})
+        self.assertEqual(idempotency.lookup('a'), {'response': 'a'})
+        self.assertIsNone(idempotency.lookup('b'))
+
+    def test_least_recently_used_evicted(self):
+        idempotency.remember('a', {'response': 'a'})
+        idempotency.remember('b', {'response': 'b'})
+        # Looking up a makes b the least recently used
+        idempotency.lookup('a')
+        idempotency.remember('c', {'response': 'c'})
+        self.assertIsNone(idempotency.lookup('b'))
+        self.assertEqual(idempotency.lookup('a'), {'response': 'a'})
+        self.assertEqual(idempotency.lookup('c'), {'response': 'c'})
+
+    def test_shared_store_fills_local_cache(self):
+        store = idempotency.InMemoryResponseStore()
+        idempotency.set_store(store)
+        store.put('a', {'response': 'a'})
+        self.assertEqual(idempotency.lookup('a'), {'response': 'a'})
+        idempotency.set_store(None)
+        self.assertEqual(idempotency.lookup('a'), {'response': 'a'})
+
+    def test_no_request_id(self):
+        idempotency.remember(None, {'response': 'a'})
+        self.assertIsNone(idempotency.lookup(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""
+Tests of slot normalization in the intent router, against the interaction
+model in alexa_skill_kit.
+"""
+import os
+import sys
+import unittest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo, "lambda_function"))
+
+import intent_router
+
+
+def resolved(value, name, code='ER_SUCCESS_MATCH'):
+    """
+    Gives a slot as sent by Alexa with an entity resolution.
+    """
+    return {
+        'value': value,
+        'resolutions': {'resolutionsPerAuthority': [{
+            'status': {'code': code},
+            'values': [{'value': {'name': name}}] if name else [],
+        }]},
+    }
+
+
+class ParseNumberTest(unittest.TestCase):
+
+    def test_digits(self):
+        self.assertEqual(intent_router._parse_number("55"), 55)
+
+    def test_words(self):
+        self.assertEqual(intent_router._parse_number("fifty five"), 55)
+        self.assertEqual(intent_router._parse_number("fifty-five"), 55)
+        self.assertEqual(intent_router._parse_number("one hundred"), 100)
+        self.assertEqual(intent_router._parse_number("a hundred"), 100)
+
+    def test_not_a_number(self):
+        self.assertIsNone(intent_router._parse_number("?"))
+        self.assertIsNone(intent_router._parse_number("fifty bananas"))
+
+
+class NormalizeSlotsTest(unittest.TestCase):
+
+    def test_missing_slots_are_none(self):
+        slots = intent_router.normalize_slots({'name': 'BrightnessIntent'})
+        self.assertEqual(slots, {'Brightness': None, 'Zone': None})
+
+    def test_number(self):
+        slots = intent_router.normalize_slots({
+            'name': 'BrightnessIntent',
+            'slots': {'Brightness': {'value': "forty"}},
+        })
+        self.assertEqual(slots['Brightness'], 40)
+
+    def test_synonym_gives_id(self):
+        slots = intent_router.normalize_slots({
+            'name': 'ColorTemperatureIntent',
+            'slots': {'LightSource': {'value': "Candle Light"}},
+        })
+        self.assertEqual(slots['LightSource'], 'CANDLE')
+
+    def test_entity_resolution_preferred(self):
+        slots = intent_router.normalize_slots({
+            'name': 'ColorTemperatureIntent',
+            'slots': {'LightSource': resolved("fire", 'candle')},
+        })
+        self.assertEqual(slots['LightSource'], 'CANDLE')
+
+    def test_entity_resolution_without_match(self):
+        slots = intent_router.normalize_slots({
+            'name': 'ColorTemperatureIntent',
+            'slots': {'LightSource': resolved("halogen bulb", None,
+                                              'ER_SUCCESS_NO_MATCH')},
+        })
+        self.assertEqual(slots['LightSource'], 'HALOGEN')
+
+    def test_unknown_value_is_none(self):
+        slots = intent_router.normalize_slots({
+            'name': 'ColorTemperatureIntent',
+            'slots': {'LightSource': {'value': "disco ball"}},
+        })
+        self.assertIsNone(slots['LightSource'])
+
+    def test_unknown_zone_kept_as_spoken(self):
+        slots = intent_router.normalize_slots({
+            'name': 'PowerStateIntent',
+            'slots': {'PowerState': {'value': "on"},
+                      'Zone': {'value': "kitchen"}},
+        })
+        self.assertEqual(slots, {'PowerState': 'ON', 'Zone': 'kitchen'})
+
+    def test_all_zones(self):
+        slots = intent_router.normalize_slots({
+            'name': 'PowerStateIntent',
+            'slots': {'Zone': {'value': "every painting"}},
+        })
+        self.assertEqual(slots['Zone'], 'ALL')
+
+
+if __name__ == '__main__':
+    unittest.main()
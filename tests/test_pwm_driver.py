@@ -0,0 +1,91 @@
+"""
+Tests of the shared memory command slots between the control process and
+the PWM driver process.
+"""
+import os
+import sys
+import threading
+import unittest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo, "raspberry_pi"))
+
+from pwm_driver import CommandSlots, encode_command, decode_command, \
+    SHOW_AT_ONCE, HEADER_SIZE, SEQUENCE, COMMAND
+
+
+class CommandTest(unittest.TestCase):
+
+    def test_kelvin_round_trip(self):
+        settings = {'power_state': "ON", 'brightness': 40,
+                    'color_temperature': 2700}
+        self.assertEqual(decode_command(encode_command(3, settings, 2.5)),
+                         (3, settings, 2.5))
+
+    def test_light_source_and_defaults_round_trip(self):
+        settings = {'power_state': "OFF", 'brightness': None,
+                    'color_temperature': 'CANDLE'}
+        self.assertEqual(decode_command(encode_command(1, settings, None)),
+                         (1, settings, None))
+
+
+OFF = {'power_state': "OFF", 'brightness': 100, 'color_temperature': 1900}
+
+
+class CommandSlotsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buffer = bytearray(CommandSlots.size(2))
+        self.slots = CommandSlots(self.buffer, 2)
+
+    def test_slots_are_independent(self):
+        first = encode_command(1, {'power_state': "ON", 'brightness': 10,
+                                   'color_temperature': 1900}, None)
+        second = encode_command(1, {'power_state': "ON", 'brightness': 90,
+                                    'color_temperature': 'CANDLE'},
+                                SHOW_AT_ONCE)
+        self.slots.write(0, first)
+        self.slots.write(1, second)
+        self.assertEqual(decode_command(self.slots.read(0)),
+                         decode_command(first))
+        self.assertEqual(decode_command(self.slots.read(1)),
+                         decode_command(second))
+
+    def test_newest_write_read(self):
+        for generation in range(1, 4):
+            self.slots.write(0, encode_command(
+                generation, {'power_state': "ON", 'brightness': generation,
+                             'color_temperature': 1900}, None))
+        generation, settings, _ = decode_command(self.slots.read(0))
+        self.assertEqual((generation, settings['brightness']), (3, 3))
+
+    def test_read_waits_for_write_in_progress(self):
+        self.slots.write(0, encode_command(1, OFF, None))
+        newer = encode_command(2, {'power_state': "ON", 'brightness': 60,
+                                   'color_temperature': 2700}, None)
+
+        def finish_write():
+            COMMAND.pack_into(self.buffer, HEADER_SIZE + SEQUENCE.size,
+                              *newer)
+            SEQUENCE.pack_into(self.buffer, HEADER_SIZE, 4)
+
+        # An odd sequence marks a write the driver must not read half of
+        SEQUENCE.pack_into(self.buffer, HEADER_SIZE, 3)
+        writer = threading.Timer(0.05, finish_write)
+        writer.start()
+        fields = self.slots.read(0)
+        writer.join()
+        self.assertEqual(decode_command(fields), decode_command(newer))
+
+    def test_done_and_stop(self):
+        self.slots.write(0, encode_command(5, OFF, None))
+        self.slots.set_done(0, 5)
+        self.assertEqual((self.slots.done(0), self.slots.done(1)), (5, 0))
+        self.assertFalse(self.slots.stopped())
+        self.slots.stop()
+        self.assertTrue(self.slots.stopped())
+        self.assertEqual(self.slots.read(0)[0], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
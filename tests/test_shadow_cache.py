@@ -0,0 +1,89 @@
+"""
+Tests of the desired state cache of shadow_connection, deciding which
+shadow writes can be skipped.
+"""
+import os
+import sys
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo, "lambda_function"))
+os.environ.setdefault("AWS_IOT_MY_THING_NAME", "my_painting")
+
+import shadow_connection
+
+
+def document(version, desired=None, reported=None):
+    """
+    Gives a shadow document, or an update response if reported is None.
+    """
+    state = {'desired': desired or {}}
+    if reported is not None:
+        state['reported'] = reported
+    return {'state': state, 'version': version}
+
+
+class RememberTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.multiple(shadow_connection, CACHE_TTL=10,
+                                      CACHE_READ=False, _cache={})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def remember_read(self, version, desired, reported):
+        shadow_connection._remember(None, document(version, desired,
+                                                   reported), True)
+
+    def test_matching_desired_and_reported_is_redundant(self):
+        self.remember_read(3, {'brightness': 50}, {'brightness': 50})
+        self.assertTrue(shadow_connection.is_redundant({'brightness': 50}))
+        self.assertFalse(shadow_connection.is_redundant({'brightness': 60}))
+
+    def test_unknown_reported_is_not_redundant(self):
+        shadow_connection._remember(None, document(1, {'brightness': 50}),
+                                    False)
+        self.assertFalse(shadow_connection.is_redundant({'brightness': 50}))
+
+    def test_reported_not_applied_is_not_redundant(self):
+        self.remember_read(3, {'brightness': 50}, {'brightness': 20})
+        self.assertFalse(shadow_connection.is_redundant({'brightness': 50}))
+
+    def test_following_version_keeps_other_fields(self):
+        self.remember_read(3, {'brightness': 50, 'power_state': "ON"},
+                           {'brightness': 50, 'power_state': "ON"})
+        shadow_connection._remember(None, document(4, {'brightness': 50}),
+                                    False)
+        self.assertTrue(shadow_connection.is_redundant(
+            {'power_state': "ON"}))
+
+    def test_version_gap_drops_other_fields(self):
+        self.remember_read(3, {'brightness': 50, 'power_state': "ON"},
+                           {'brightness': 50, 'power_state': "ON"})
+        # Another writer updated the shadow as version 4
+        shadow_connection._remember(None, document(5, {'brightness': 50}),
+                                    False)
+        self.assertFalse(shadow_connection.is_redundant(
+            {'power_state': "ON"}))
+
+    def test_expired_entry_is_not_redundant(self):
+        self.remember_read(3, {'brightness': 50}, {'brightness': 50})
+        with mock.patch.object(shadow_connection.time, 'monotonic',
+                               return_value=10 ** 9):
+            self.assertFalse(shadow_connection.is_redundant(
+                {'brightness': 50}))
+
+    def test_disabled_cache_is_never_redundant(self):
+        self.remember_read(3, {'brightness': 50}, {'brightness': 50})
+        with mock.patch.object(shadow_connection, 'CACHE_TTL', 0):
+            self.assertFalse(shadow_connection.is_redundant(
+                {'brightness': 50}))
+
+
+if __name__ == '__main__':
+    unittest.main()
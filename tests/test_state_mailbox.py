@@ -0,0 +1,58 @@
+"""
+Tests of the latest-wins mailbox between the MQTT callback and the light
+updater thread.
+"""
+import os
+import sys
+import time
+import threading
+import unittest
+
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(repo, "raspberry_pi"))
+
+from state_mailbox import LatestMailbox
+
+
+class LatestMailboxTest(unittest.TestCase):
+
+    def test_updates_coalesce(self):
+        mailbox = LatestMailbox()
+        self.assertFalse(mailbox.put({'brightness': 10, 'power_state': "ON"}))
+        self.assertTrue(mailbox.put({'brightness': 20}))
+        self.assertEqual(mailbox.take(), {'brightness': 20,
+                                          'power_state': "ON"})
+
+    def test_put_does_not_change_caller_dict(self):
+        mailbox = LatestMailbox()
+        update = {'brightness': 10}
+        mailbox.put(update)
+        mailbox.put({'brightness': 20})
+        self.assertEqual(update, {'brightness': 10})
+
+    def test_take_after_take_waits_for_new_update(self):
+        mailbox = LatestMailbox()
+        mailbox.put({'brightness': 10})
+        mailbox.take()
+        timer = threading.Timer(.05, mailbox.put, ({'brightness': 30},))
+        timer.start()
+        self.assertEqual(mailbox.take(), {'brightness': 30})
+        timer.join()
+
+    def test_debounce_waits_for_burst_to_settle(self):
+        mailbox = LatestMailbox(debounce=.1)
+        start = time.monotonic()
+        mailbox.put({'brightness': 10})
+        self.assertEqual(mailbox.take(), {'brightness': 10})
+        self.assertGreaterEqual(time.monotonic() - start, .1)
+
+    def test_close_wakes_take(self):
+        mailbox = LatestMailbox()
+        timer = threading.Timer(.05, mailbox.close)
+        timer.start()
+        self.assertIsNone(mailbox.take())
+        timer.join()
+
+
+if __name__ == '__main__':
+    unittest.main()